@@ -0,0 +1,431 @@
+"""Benchmarks for blockstack-cli, run against a bundled stub of the blockstack api
+
+    $ python bench.py startup
+    $ python bench.py all --names 100000 --page_size 10000 --utxos 50000
+    $ python bench.py serve --port 6270 --latency 20
+
+`startup` exits non-zero when cold start regresses, so it can gate CI. Everything
+else starts the stub on a free local port, so no live node is needed and runs
+are repeatable: every payload is generated from its index, never at random.
+"""
+import click
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import cli
+
+# modules the CLI must not import until a command actually needs them
+LAZY_MODULES = ['requests', 'json', 'yaml', 'toml', 'concurrent.futures']
+
+###########################
+# STUB API SERVER
+###########################
+STUB_NAMESPACE = {
+    'namespace_id': 'id',
+    'base': 4,
+    'coeff': 250,
+    'buckets': [6, 5, 4, 3, 2, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+    'nonalpha_discount': 10,
+    'no_vowel_discount': 10,
+    'lifetime': 52595,
+}
+STUB_ADDRESS = '1BenchAddressXXXXXXXXXXXXXXXXXXXX'
+# the node wallet's payment key, and somewhere valid for `wallet send` to pay
+STUB_PAYMENT_KEY = '11' * 32 + '01'
+STUB_PAYEE = '1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMH'
+
+class StubAPI(object):
+    """deterministic stand-in for the /v1 endpoints the CLI calls"""
+
+    def __init__(self, names=10000, page_size=100, utxos=1000, history=10, latency=0.0, capacity=0):
+        self.names = names
+        self.page_size = page_size
+        self.utxos = utxos
+        self.history = history
+        self.latency = latency
+        # like a real node, at most CAPACITY requests are worked on at once, three times as
+        # many may queue for them, and anything past that is turned away with a 429
+        self.capacity = capacity
+        self.slots = threading.Semaphore(capacity) if capacity else None
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.rejected = 0
+
+    def enter(self):
+        """wait for a free slot, False when the queue is full and the request gets a 429"""
+        with self.lock:
+            if self.queued >= 4 * self.capacity:
+                self.rejected += 1
+                return False
+            self.queued += 1
+        self.slots.acquire()
+        return True
+
+    def leave(self):
+        with self.lock:
+            self.queued -= 1
+        self.slots.release()
+
+    def name(self, i):
+        return 'name{:07d}.id'.format(i)
+
+    def index(self, name):
+        match = re.match(r'^name(\d{7})\.id$', name)
+        if match and int(match.group(1)) < self.names:
+            return int(match.group(1))
+        return None
+
+    def owner(self, i):
+        return '1Owner{:025d}'.format(i % 1000)
+
+    def zonefile(self, name):
+        return '$ORIGIN {}\n$TTL 3600\n_http._tcp URI 10 1 "https://gaia.blockstack.org/hub/{}/profile.json"\n'.format(name, name)
+
+    def zonefile_hash(self, name):
+        import binascii
+        return binascii.hexlify(cli.hash160(self.zonefile(name).encode('utf-8'))).decode('ascii')
+
+    def record(self, i):
+        return {'address': self.owner(i), 'blockchain': 'bitcoin', 'expire_block': 600000 + i,
+                'last_txid': '{:064x}'.format(i), 'status': 'registered', 'zonefile_hash': self.zonefile_hash(self.name(i))}
+
+    def utxo(self, i):
+        return {'transaction_hash': '{:064x}'.format(i), 'output_index': i % 4, 'value': 10000 + i * 37 % 100000,
+                'confirmations': i % 12, 'script_hex': '76a914{:040x}88ac'.format(i)}
+
+    def route(self, method, path, query):
+        """return (status, body) for one request"""
+        if method != 'GET':
+            return 202, {'success': True, 'transaction_hash': '{:064x}'.format(len(path))}
+        page = int(query.get('page', ['0'])[0])
+        if path in ('/v1/names', '/v1/namespaces/id/names'):
+            return 200, [self.name(i) for i in range(page * self.page_size, min(self.names, (page + 1) * self.page_size))]
+        if path == '/v1/node/ping':
+            return 200, {'status': 'alive', 'version': '0.14.4.2'}
+        if path == '/v1/node/registrar/state':
+            return 200, []
+        if path == '/v1/node/config':
+            return 200, cli.make_default_config()
+        if path.startswith('/v1/wallet/balance'):
+            return 200, {'balance': {'satoshis': 5000000000, 'bitcoin': 50.0}}
+        if path == '/v1/wallet/keys':
+            return 200, {'payment_privkey': STUB_PAYMENT_KEY}
+        if path.startswith('/v1/wallet/'):
+            return 200, {'address': STUB_ADDRESS}
+        if path == '/v1/blockchains/bitcoin/consensus':
+            return 200, {'consensus_hash': 'b' * 32}
+        if path == '/v1/blockchains/bitcoin/pending':
+            return 200, {'queues': {}}
+        if re.match(r'^/v1/blockchains/bitcoin/[^/]+/unspent$', path):
+            return 200, [self.utxo(i) for i in range(self.utxos)]
+        if path == '/v1/namespaces':
+            return 200, ['id']
+        if path == '/v1/namespaces/id':
+            return 200, STUB_NAMESPACE
+        if path.startswith('/v1/prices/namespaces/'):
+            return 200, {'satoshis': 4000000000}
+        match = re.match(r'^/v1/prices/names/(.+)\.id$', path)
+        if match:
+            return 200, {'name_price': {'satoshis': cli.name_price(match.group(1), STUB_NAMESPACE), 'units': 'BTC'}}
+        match = re.match(r'^/v1/addresses/bitcoin/1Owner(\d+)$', path)
+        if match:
+            return 200, {'names': [self.name(i) for i in range(int(match.group(1)), self.names, 1000)]}
+        match = re.match(r'^/v1/names/([^/]+)(/.*)?$', path)
+        if match:
+            name, rest = match.group(1), match.group(2) or ''
+            i = self.index(name)
+            if i is None:
+                return 404, {'error': 'Name not found'}
+            if rest == '':
+                return 200, self.record(i)
+            if rest == '/history':
+                return 200, dict((str(500000 + b), [{'opcode': 'NAME_UPDATE', 'txid': '{:064x}'.format(b)}]) for b in range(self.history))
+            if rest.startswith('/zonefile'):
+                return 200, {'zonefile': self.zonefile(name)}
+        return 404, {'error': 'Not found'}
+
+def make_handler(api):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body go out in separate writes, which Nagle would hold back for a delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def handle_any(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                self.rfile.read(length)
+            if api.capacity and not api.enter():
+                status, body = 429, {'error': 'Too many requests'}
+            else:
+                try:
+                    if api.latency:
+                        time.sleep(api.latency)
+                    url = urlparse(self.path)
+                    status, body = api.route(self.command, url.path, parse_qs(url.query))
+                finally:
+                    if api.capacity:
+                        api.leave()
+            body = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '1')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = do_PUT = do_DELETE = handle_any
+    return StubHandler
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops SYNs as soon as a client opens connections in a burst
+    request_queue_size = 1024
+
+def start_stub(api, port=0):
+    """serve API on localhost from a background thread, returning the server and the host:port to point --host at"""
+    server = StubServer(('127.0.0.1', port), make_handler(api))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, '127.0.0.1:{}'.format(server.server_address[1])
+
+###########################
+# HELPERS
+###########################
+def run_python(code, *args):
+    # installed copies run from cached bytecode, so let the first run write it
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return subprocess.check_output([sys.executable, '-c', code] + list(args), cwd=HERE, env=env)
+
+def median(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2]
+
+def median_ms(code, args, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.time()
+        run_python(code, *args)
+        samples.append((time.time() - start) * 1000)
+    return median(samples)
+
+def invoke(host, args):
+    """run one CLI command in-process against HOST, returning its wall time in ms"""
+    from click.testing import CliRunner
+    start = time.time()
+    result = CliRunner().invoke(cli.cli, ['--host', host] + args)
+    elapsed = (time.time() - start) * 1000
+    if result.exit_code != 0:
+        raise click.ClickException("{} failed: {}".format(' '.join(args), result.output or result.exception))
+    return elapsed
+
+def stub_options(f):
+    f = click.option('--capacity', default=0, help='requests the stub works on at once, 429 past four times that queued (0 for no limit)')(f)
+    f = click.option('--latency', default=0.0, help='milliseconds the stub sleeps before every answer')(f)
+    f = click.option('--history', default=10, help='entries in every name history')(f)
+    f = click.option('--utxos', default=1000, help='entries in every UTXO set')(f)
+    f = click.option('--page_size', default=100, help='names per page')(f)
+    f = click.option('--names', default=10000, help='names the stub serves')(f)
+    return f
+
+def make_stub(names, page_size, utxos, history, latency, capacity):
+    return StubAPI(names, page_size, utxos, history, latency / 1000.0, capacity)
+
+@click.group()
+def bench():
+    """benchmarks for blockstack-cli"""
+    pass
+
+# python bench.py serve
+@bench.command()
+@click.option('--port', default=6270, help='port to listen on')
+@stub_options
+def serve(port, names, page_size, utxos, history, latency, capacity):
+    """run the stub api in the foreground, for poking at by hand"""
+    server, host = start_stub(make_stub(names, page_size, utxos, history, latency, capacity), port)
+    click.echo("stub blockstack api on {}, ctrl-c to stop".format(host))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+# python bench.py startup
+@bench.command()
+@click.option('--runs', default=15, help='cold starts to sample per command')
+@click.option('--max_overhead_ms', default=25.0, help='fail when a cold start costs more than this over an empty click app')
+def startup(runs, max_overhead_ms):
+    """measure cold start of `--help` and `node --help`, fail on regression"""
+    failed = False
+    loaded = run_python("import sys, cli; print(' '.join(m for m in {!r} if m in sys.modules))".format(LAZY_MODULES)).decode('ascii').split()
+    if loaded:
+        click.echo("FAIL eagerly imported by `import cli`: {}".format(', '.join(loaded)))
+        failed = True
+
+    # an empty click app printing its help is the floor the CLI is measured against
+    floor = median_ms("import click; click.command()(lambda: None)(prog_name='empty')", ['--help'], runs)
+    click.echo("{:<24} {:8.1f} ms".format("empty click app", floor))
+    for args in (['--help'], ['node', '--help']):
+        ms = median_ms("import cli; cli.cli(prog_name='blockstack-cli')", args, runs)
+        overhead = ms - floor
+        status = "ok" if overhead <= max_overhead_ms else "FAIL"
+        failed = failed or status == "FAIL"
+        click.echo("{:<24} {:8.1f} ms  (+{:.1f} ms) {}".format(' '.join(args), ms, overhead, status))
+    if failed:
+        sys.exit(1)
+
+# python bench.py commands
+@bench.command()
+@click.option('--runs', default=20, help='invocations to sample per command')
+@stub_options
+def commands(runs, names, page_size, utxos, history, latency, capacity):
+    """median latency of single commands, cold (new process) and warm (in-process)"""
+    server, host = start_stub(make_stub(names, page_size, utxos, history, latency, capacity))
+    sample = [
+        ['node', 'ping'],
+        ['name', 'get', 'name0000001.id'],
+        ['name', 'history', 'name0000001.id'],
+        ['name', 'get-page', '0'],
+        ['name', 'address', '1Owner0000000000000000000000001'],
+        ['blockchain', 'get-utxo', STUB_ADDRESS],
+        ['price', 'name', 'name0000001.id'],
+        ['namespace', 'names', '0'],
+        ['wallet', 'send', '--tx_only', '--key', 'node', '--confirmations', '1', '1500000', STUB_PAYEE],
+    ]
+    click.echo("{:<52} {:>10} {:>10}".format("command", "cold ms", "warm ms"))
+    for args in sample:
+        cold = median_ms("import cli; cli.cli(prog_name='blockstack-cli')", ['--host', host] + args, max(3, runs // 4))
+        warm = median([invoke(host, args) for _ in range(runs)])
+        click.echo("{:<52} {:10.1f} {:10.1f}".format(' '.join(args), cold, warm))
+    server.shutdown()
+
+# python bench.py paging
+@bench.command()
+@click.option('--workers', default='1,8,32', help='comma separated worker counts to compare')
+@stub_options
+def paging(workers, names, page_size, utxos, history, latency, capacity):
+    """names per second through `name get-page --all` at several worker counts"""
+    server, host = start_stub(make_stub(names, page_size, utxos, history, latency, capacity))
+    click.echo("{:<12} {:>10} {:>14}".format("workers", "seconds", "names/s"))
+    for count in [int(w) for w in workers.split(',')]:
+        seconds = invoke(host, ['name', 'get-page', '--all', '--workers', str(count)]) / 1000
+        click.echo("{:<12} {:10.2f} {:14.0f}".format(count, seconds, names / seconds))
+    server.shutdown()
+
+# python bench.py adaptive
+@bench.command()
+@click.option('--lookups', default=2000, help='names looked up per run')
+@click.option('--workers', default=64, help='--concurrency of every run, the ceiling for --adaptive')
+@click.option('--rate', type=float, default=None, help='also compare a run capped at this many requests per second')
+@stub_options
+def adaptive(lookups, workers, rate, names, page_size, utxos, history, latency, capacity):
+    """`name get --from_file` with fixed concurrency against --adaptive, try --latency 5 --capacity 8"""
+    import tempfile
+    stub = make_stub(names, page_size, utxos, history, latency, capacity)
+    server, host = start_stub(stub)
+    fd, path = tempfile.mkstemp(suffix='.names')
+    with os.fdopen(fd, 'w') as f:
+        f.write('\n'.join(stub.name(i % names) for i in range(lookups)) + '\n')
+    runs = [("fixed", []), ("adaptive", ['--adaptive'])]
+    if rate:
+        runs.append(("rate {:g}/s".format(rate), ['--rate', str(rate)]))
+    click.echo("{:<16} {:>10} {:>12} {:>8}".format("mode", "seconds", "lookups/s", "429s"))
+    try:
+        for label, options in runs:
+            rejected = stub.rejected
+            seconds = invoke(host, options + ['name', 'get', '--from_file', path, '--concurrency', str(workers)]) / 1000
+            click.echo("{:<16} {:10.2f} {:12.0f} {:8}".format(label, seconds, lookups / seconds, stub.rejected - rejected))
+    finally:
+        os.remove(path)
+        server.shutdown()
+
+# python bench.py formatters
+@bench.command()
+@click.option('--runs', default=5, help='renders to sample per format')
+@stub_options
+def formatters(runs, names, page_size, utxos, history, latency, capacity):
+    """cost of output() for every --fmt, --fields and --where on a large name page and a large UTXO set"""
+    server, host = start_stub(make_stub(names, page_size, utxos, history, latency, capacity))
+    client = cli.BlockstackClient(host)
+    payloads = [
+        ("name page ({} names)".format(min(names, page_size)), client.get_names_page(0, raw=True)),
+        ("utxo set ({} entries)".format(utxos), client.get_utxo(STUB_ADDRESS, raw=True)),
+    ]
+    # --fields and --where pick `value`, the field a bare name and a UTXO both have
+    cases = [(fmt, fmt, None, []) for fmt in sorted(cli.FORMATTERS)]
+    cases += [(fmt, fmt, None, []) for fmt in cli.RECORD_FORMATS]
+    cases += [
+        ('json --fields value', 'json', ['value'], []),
+        ('json --where value~7', 'json', None, ['value~7']),
+        ('csv --fields value --where value~7', 'csv', ['value'], ['value~7']),
+    ]
+    config = cli.Config()
+    devnull = open(os.devnull, 'w')
+    click.echo("{:<32} {:<36} {:>10}".format("payload", "fmt", "ms"))
+    for label, r in payloads:
+        for case, fmt, fields, wheres in cases:
+            config.fmt = fmt
+            samples = []
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                for _ in range(runs):
+                    start = time.time()
+                    # the same RecordWriter the root command installs, closed as it is at exit
+                    if fields or wheres or fmt in cli.RECORD_FORMATS:
+                        config.records = cli.RecordWriter(fmt, fields, [cli.parse_where(expr) for expr in wheres])
+                    cli.output(config, r)
+                    if config.records is not None:
+                        config.records.close()
+                    samples.append((time.time() - start) * 1000)
+                cost = "{:10.1f}".format(median(samples))
+            except Exception:
+                # toml can not write a top level list
+                cost = "{:>10}".format("n/a")
+            finally:
+                sys.stdout = stdout
+                config.records = None
+            click.echo("{:<32} {:<36} {}".format(label, case, cost))
+    server.shutdown()
+
+# python bench.py all
+@bench.command('all')
+@stub_options
+@click.pass_context
+def run_all(ctx, names, page_size, utxos, history, latency, capacity):
+    """run every benchmark in turn, exiting non-zero if startup regressed"""
+    stub = dict(names=names, page_size=page_size, utxos=utxos, history=history, latency=latency, capacity=capacity)
+    code = 0
+    for command in (startup, commands, paging, formatters):
+        click.echo("\n== {} ==".format(command.name))
+        params = dict((p.name, p.default) for p in command.params)
+        params.update((k, v) for k, v in stub.items() if k in params)
+        try:
+            ctx.invoke(command, **params)
+        except SystemExit as e:
+            code = code or e.code
+    ctx.exit(code)
+
+if __name__ == '__main__':
+    bench()
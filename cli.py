@@ -1,9 +1,448 @@
 import click
-import requests
-import json
-import toml
-import yaml
 import os
+import sys
+import itertools
+import collections
+import binascii
+import re
+import struct
+import functools
+import io
+
+# requests, json, yaml, toml and the other heavy modules are imported inside the functions
+# that use them, so `--help` and local-only commands start without paying for them
+
+class BlockstackAPIError(click.ClickException):
+    """a non 2xx answer from the blockstack api, the response is kept on .response"""
+
+    def __init__(self, response):
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        message = body.get('error', body) if isinstance(body, dict) else body
+        super(BlockstackAPIError, self).__init__("{} {}: {}".format(response.status_code, response.request.url, message))
+        self.response = response
+        self.status_code = response.status_code
+
+HOST_RETRY_SECONDS = 30
+HEALTH_CHECK_TIMEOUT = 5
+
+class HostStats(object):
+    """latency samples and health of one api node"""
+
+    def __init__(self, host):
+        self.host = host
+        self.ewma = None
+        self.samples = collections.deque(maxlen=200)
+        self.down_until = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.ewma = seconds if self.ewma is None else 0.8 * self.ewma + 0.2 * seconds
+
+    def fail(self):
+        import time
+        self.down_until = time.time() + HOST_RETRY_SECONDS
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+    def percentile(self, p):
+        # too few samples to know what slow looks like yet
+        if len(self.samples) < 10:
+            return None
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+# --adaptive: requests in flight to a node when a run starts, before it has shown what it can take
+ADAPTIVE_START = 4
+# a response this many times slower than the node's recent best counts as a sign of queueing,
+# unless it is within ADAPTIVE_FLOOR seconds of it, which on a nearby node is only noise
+ADAPTIVE_TOLERANCE = 2.0
+ADAPTIVE_FLOOR = 0.01
+# how long a waiting request sleeps before looking for a free slot again
+ADMISSION_POLL = 0.05
+RETRY_AFTER_MAX = 60
+
+class HostLimit(object):
+    """the admission state of one api node"""
+
+    def __init__(self, limit, burst):
+        self.limit = limit
+        self.inflight = 0
+        self.tokens = burst
+        self.stamp = None
+        self.samples = collections.deque(maxlen=100)
+        self.slow_start = True
+        self.last_decrease = 0
+        self.paused_until = 0
+
+class AdmissionController(object):
+    """how many requests each node gets at once and how fast, shared by every request of a run
+
+    With ADAPTIVE the limit per node moves AIMD style: it starts at ADAPTIVE_START, doubles
+    every round trip until the node pushes back, then grows by one per round trip. A
+    connection error, 5xx or 429 halves it, and a response well over the node's recent
+    best latency takes off a tenth, at most once per round trip. CEILING (the pool size,
+    so the bulk commands' --workers) caps it. RATE adds a token bucket of that many
+    requests per second per node. A Retry-After on a 429 or 503 pauses the node.
+    """
+
+    def __init__(self, ceiling, adaptive=True, rate=None):
+        import threading
+        self.ceiling = ceiling
+        self.adaptive = adaptive
+        self.rate = rate
+        # a tenth of a second's worth, so a run starts paced instead of with a second's worth at once
+        self.burst = max(1.0, (rate or 0) / 10.0)
+        self.hosts = {}
+        self.cond = threading.Condition(threading.Lock())
+
+    def state(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostLimit(float(ADAPTIVE_START) if self.adaptive else float('inf'), self.burst)
+        return self.hosts[host]
+
+    def _admit(self, host, now):
+        state = self.state(host)
+        if now < state.paused_until:
+            return state.paused_until - now
+        if state.inflight >= max(1, int(min(state.limit, self.ceiling))):
+            return ADMISSION_POLL
+        if self.rate:
+            if state.stamp is not None:
+                state.tokens = min(self.burst, state.tokens + (now - state.stamp) * self.rate)
+            state.stamp = now
+            if state.tokens < 1:
+                return (1 - state.tokens) / self.rate
+            state.tokens -= 1
+        state.inflight += 1
+        return None
+
+    def admit(self, host):
+        """take a slot on HOST, or return how many seconds to wait before asking again"""
+        import time
+        with self.cond:
+            return self._admit(host, time.time())
+
+    def acquire(self, host):
+        import time
+        with self.cond:
+            while True:
+                wait = self._admit(host, time.time())
+                if wait is None:
+                    return
+                self.cond.wait(wait)
+
+    def release(self, host, seconds, status, retry_after=None):
+        """give back the slot of a request that took SECONDS and got STATUS, None for a connection error"""
+        import time
+        now = time.time()
+        with self.cond:
+            state = self.state(host)
+            state.inflight -= 1
+            if status in (429, 503) and retry_after:
+                try:
+                    state.paused_until = now + min(float(retry_after), RETRY_AFTER_MAX)
+                except ValueError:
+                    # an HTTP date, rare enough to leave to the halving below
+                    pass
+            if self.adaptive:
+                self.adjust(state, seconds, status, now)
+            self.cond.notify_all()
+
+    def adjust(self, state, seconds, status, now):
+        pushed_back = status is None or status == 429 or status >= 500
+        if not pushed_back:
+            state.samples.append(seconds)
+        best = min(state.samples) if len(state.samples) >= 10 else None
+        queueing = best is not None and seconds > max(ADAPTIVE_TOLERANCE * best, best + ADAPTIVE_FLOOR)
+        if pushed_back or queueing:
+            # every request of the same burst sees the same trouble, so back off once per round trip
+            if now - state.last_decrease >= seconds:
+                state.limit = max(1.0, state.limit * (0.5 if pushed_back else 0.9))
+                state.slow_start = False
+                state.last_decrease = now
+        elif state.limit < self.ceiling:
+            state.limit = min(float(self.ceiling), state.limit + (1.0 if state.slow_start else 1.0 / state.limit))
+
+    def report(self):
+        return ', '.join("{} {}".format(host, int(min(state.limit, self.ceiling))) for host, state in sorted(self.hosts.items()))
+
+class BlockstackClient(object):
+    """one method per blockstack api endpoint, sharing a keep-alive connection pool
+
+        >>> client = BlockstackClient('localhost:6270', password='foobarbaz')
+        >>> client.get_name('muneeb.id')['address']
+
+    Methods return the decoded JSON body and raise BlockstackAPIError on a non 2xx
+    response. Pass raw=True to get the requests.Response back untouched instead.
+    Any other keyword (headers, timeout, ...) is handed on to requests.
+
+    HOST may list several nodes separated by commas. Chain reads (ROUTED_PATHS) then
+    go to the fastest healthy node, failing over on errors, and with HEDGE set a read
+    that runs past that latency percentile is duplicated to the next fastest node.
+    Writes, and reads of node, wallet and registrar state, the mempool and the
+    consensus hash, always go to the first node, since the writes spend that node's
+    wallet.
+    """
+
+    def __init__(self, host='localhost:6270', password='foobarbaz', ssl=False, pool_size=10, hedge=None, tracer=None):
+        self.hosts = [h.strip() for h in host.split(',') if h.strip()]
+        self.host = self.hosts[0]
+        self.method = 'https://' if ssl else 'http://'
+        self.password = password
+        self.pool_size = pool_size
+        self.hedge = hedge
+        self.tracer = tracer
+        self.cache = None
+        self.admission = None
+        self.stats = dict((h, HostStats(h)) for h in self.hosts)
+        self._checked = False
+        self._session = None
+        self._hedge_pool = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = make_session(self.pool_size, self.tracer)
+        return self._session
+
+    def ensure_pool(self, size):
+        """grow the connection pool so SIZE concurrent workers never open throwaway connections"""
+        if size > self.pool_size:
+            self.pool_size = size
+            if self.admission is not None:
+                self.admission.ceiling = size
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def url(self, path, host=None):
+        return "{}{}{}".format(self.method,host or self.host,path)
+
+    def headers(self):
+        return {'Authorization': 'bearer {}'.format(self.password), 'Origin': 'http://localhost:3000', 'Content-Type': 'application/json'}
+
+    def send(self, method, url, **kwargs):
+        if self.admission is None:
+            return self._send(method, url, **kwargs)
+        import time
+        host = url[len(self.method):].split('/', 1)[0]
+        self.admission.acquire(host)
+        start = time.time()
+        r = None
+        try:
+            r = self._send(method, url, **kwargs)
+        finally:
+            self.admission.release(host, time.time() - start, None if r is None else r.status_code,
+                                   None if r is None else r.headers.get('Retry-After'))
+        return r
+
+    def _send(self, method, url, **kwargs):
+        if self.tracer is None:
+            return self.session.request(method, url, **kwargs)
+        return self.tracer.request(self.session, method, url, **kwargs)
+
+    def request(self, method, path, raw=False, headers=None, **kwargs):
+        headers = dict(self.headers(), **(headers or {}))
+        key = self.cache.key(path, kwargs.get('params')) if self.cache is not None and method == 'GET' else None
+        r = self.cache.get(key, self.url(key), headers) if key is not None else None
+        if r is None:
+            if method == 'GET' and len(self.hosts) > 1 and ROUTED_PATHS.match(path):
+                r = self.routed_get(path, headers, kwargs)
+            else:
+                r = self.send(method, self.url(path), headers=headers, **kwargs)
+            if key is not None:
+                self.cache.put(key, r)
+        if raw:
+            return r
+        if not r.ok:
+            raise BlockstackAPIError(r)
+        return decode_json(r) if r.text else None
+
+    def cached(self, path):
+        """the --cache answer to GET PATH as a requests.Response, or None, never asking a node for it"""
+        key = self.cache.key(path) if self.cache is not None else None
+        return self.cache.get(key, self.url(key), self.headers()) if key is not None else None
+
+    def check_hosts(self):
+        """ping every node at once, recording its latency or marking it down"""
+        probe = lambda host: self.send_get(host, "/v1/node/ping", self.headers(), {'timeout': HEALTH_CHECK_TIMEOUT})
+        for _ in bounded_map(lambda host: self._attempt(probe, host), self.hosts, len(self.hosts)):
+            pass
+        self._checked = True
+
+    def ranked_hosts(self):
+        """healthy nodes, fastest first, or every node when none look healthy"""
+        import time
+        now = time.time()
+        stats = [self.stats[h] for h in self.hosts]
+        healthy = [s for s in stats if s.healthy(now)] or stats
+        return [s.host for s in sorted(healthy, key=lambda s: float('inf') if s.ewma is None else s.ewma)]
+
+    def send_get(self, host, path, headers, kwargs):
+        import time
+        import requests
+        stats = self.stats[host]
+        start = time.time()
+        try:
+            r = self.send('GET', self.url(path, host), headers=headers, **kwargs)
+        except requests.RequestException:
+            stats.fail()
+            raise
+        stats.record(time.time() - start)
+        # a node that is reindexing answers 5xx, so steer reads away from it for a while
+        if r.status_code >= 500:
+            stats.fail()
+        return r
+
+    def _attempt(self, send, host):
+        import requests
+        try:
+            return send(host), None
+        except requests.RequestException as e:
+            return None, e
+
+    def routed_get(self, path, headers, kwargs):
+        if not self._checked:
+            self.check_hosts()
+        hosts = self.ranked_hosts()
+        send = lambda host: self.send_get(host, path, headers, kwargs)
+        if not self.hedge:
+            for host in hosts:
+                r, error = self._attempt(send, host)
+                if r is not None and r.status_code < 500:
+                    return r
+            return self._last(r, error)
+        return self.hedged_get(hosts, send)
+
+    def hedged_get(self, hosts, send):
+        """start on the fastest node, and whenever every request in flight has run past
+        its node's HEDGE percentile (or failed), start the same read on the next node"""
+        from concurrent import futures
+        if self._hedge_pool is None:
+            self._hedge_pool = futures.ThreadPoolExecutor(max_workers=2 * self.pool_size)
+        inflight = []
+        r, error, latest = None, None, None
+        while hosts or inflight:
+            if hosts and not inflight:
+                latest = hosts.pop(0)
+                inflight.append(self._hedge_pool.submit(self._attempt, send, latest))
+            timeout = self.stats[latest].percentile(self.hedge) if hosts else None
+            done, pending = futures.wait(inflight, timeout=timeout, return_when=futures.FIRST_COMPLETED)
+            inflight = list(pending)
+            for f in done:
+                r, error = f.result()
+                if r is not None and r.status_code < 500:
+                    return r
+            if not done and hosts:
+                latest = hosts.pop(0)
+                inflight.append(self._hedge_pool.submit(self._attempt, send, latest))
+        return self._last(r, error)
+
+    def _last(self, r, error):
+        if r is not None:
+            return r
+        raise error
+
+    # https://blockstack.github.io/blockstack-core/#core-node-administration
+    def ping(self, raw=False, **kwargs):
+        return self.request('GET', "/v1/node/ping", raw, **kwargs)
+
+    def get_registrar_state(self, raw=False, **kwargs):
+        return self.request('GET', "/v1/node/registrar/state", raw, **kwargs)
+
+    def get_node_config(self, raw=False, **kwargs):
+        return self.request('GET', "/v1/node/config", raw, **kwargs)
+
+    def set_node_config(self, section, key, value, raw=False, **kwargs):
+        return self.request('POST', "/v1/node/config/{}".format(section), raw, params={key: value}, **kwargs)
+
+    def delete_node_config(self, section, key, raw=False, **kwargs):
+        return self.request('DELETE', "/v1/node/config/{}/{}".format(section,key), raw, **kwargs)
+
+    def delete_node_config_section(self, section, raw=False, **kwargs):
+        return self.request('DELETE', "/v1/node/config/{}".format(section), raw, **kwargs)
+
+    # https://blockstack.github.io/blockstack-core/#core-wallet-management
+    def get_payment_address(self, raw=False, **kwargs):
+        return self.request('GET', "/v1/wallet/payment_address", raw, **kwargs)
+
+    def get_owner_address(self, raw=False, **kwargs):
+        return self.request('GET', "/v1/wallet/owner_address", raw, **kwargs)
+
+    def get_data_pubkey(self, raw=False, **kwargs):
+        return self.request('GET', "/v1/wallet/data_pubkey", raw, **kwargs)
+
+    def get_balance(self, confirmations=6, raw=False, **kwargs):
+        return self.request('GET', "/v1/wallet/balance/{}".format(confirmations), raw, **kwargs)
+
+    def get_wallet_keys(self, raw=False, **kwargs):
+        return self.request('GET', "/v1/wallet/keys", raw, **kwargs)
+
+    # https://blockstack.github.io/blockstack-core/#managing-names
+    def register_name(self, name, raw=False, **kwargs):
+        return self.request('POST', "/v1/names", raw, json={'name': name}, **kwargs)
+
+    def revoke_name(self, name, raw=False, **kwargs):
+        return self.request('DELETE', "/v1/names/{}".format(name), raw, **kwargs)
+
+    def transfer_name(self, name, owner, raw=False, **kwargs):
+        return self.request('PUT', "/v1/names/{}/owner".format(name), raw, json={'owner': owner}, **kwargs)
+
+    def set_zonefile(self, name, zonefile, raw=False, **kwargs):
+        return self.request('PUT', "/v1/names/{}/zonefile".format(name), raw, json={'zonefile': zonefile}, **kwargs)
+
+    def get_zonefile(self, name, raw=False, **kwargs):
+        return self.request('GET', "/v1/names/{}/zonefile".format(name), raw, **kwargs)
+
+    # https://blockstack.github.io/blockstack-core/#name-querying
+    def get_names_page(self, page, raw=False, **kwargs):
+        return self.request('GET', "/v1/names", raw, params={'page': page}, **kwargs)
+
+    def get_name(self, name, raw=False, **kwargs):
+        return self.request('GET', "/v1/names/{}".format(name), raw, **kwargs)
+
+    def get_name_history(self, name, raw=False, **kwargs):
+        return self.request('GET', "/v1/names/{}/history".format(name), raw, **kwargs)
+
+    def get_historic_zonefile(self, name, zonefile_hash, raw=False, **kwargs):
+        return self.request('GET', "/v1/names/{}/zonefile/{}".format(name,zonefile_hash), raw, **kwargs)
+
+    def get_names_owned(self, address, blockchain='bitcoin', raw=False, **kwargs):
+        return self.request('GET', "/v1/addresses/{}/{}".format(blockchain,address), raw, **kwargs)
+
+    # https://blockstack.github.io/blockstack-core/#price-checks
+    def get_namespace_price(self, namespace, raw=False, **kwargs):
+        return self.request('GET', "/v1/prices/namespaces/{}".format(namespace), raw, **kwargs)
+
+    def get_name_price(self, name, raw=False, **kwargs):
+        return self.request('GET', "/v1/prices/names/{}".format(name), raw, **kwargs)
+
+    # https://blockstack.github.io/blockstack-core/#blockchain-operations
+    def get_consensus(self, blockchain='bitcoin', raw=False, **kwargs):
+        return self.request('GET', "/v1/blockchains/{}/consensus".format(blockchain), raw, **kwargs)
+
+    def get_pending(self, blockchain='bitcoin', raw=False, **kwargs):
+        return self.request('GET', "/v1/blockchains/{}/pending".format(blockchain), raw, **kwargs)
+
+    def get_utxo(self, address, blockchain='bitcoin', raw=False, **kwargs):
+        return self.request('GET', "/v1/blockchains/{}/{}/unspent".format(blockchain,address), raw, **kwargs)
+
+    def broadcast_transaction(self, tx, blockchain='bitcoin', raw=False, **kwargs):
+        return self.request('POST', "/v1/blockchains/{}/txs".format(blockchain), raw, json={'tx': tx}, **kwargs)
+
+    # https://blockstack.github.io/blockstack-core/#namespace-operations
+    def get_namespaces(self, raw=False, **kwargs):
+        return self.request('GET', "/v1/namespaces", raw, **kwargs)
+
+    def get_namespace(self, namespace, raw=False, **kwargs):
+        return self.request('GET', "/v1/namespaces/{}".format(namespace), raw, **kwargs)
+
+    def get_namespace_names(self, namespace, page, raw=False, **kwargs):
+        return self.request('GET', "/v1/namespaces/{}/names".format(namespace), raw, params={'page': page}, **kwargs)
 
 class Config(object):
     
@@ -13,111 +452,2165 @@ class Config(object):
         self.password = 'foobarbaz'
         self.debug = False
         self.fmt = 'json'
+        self.pool_size = 10
+        self.hedge = None
+        self.cache_dir = os.path.join(os.path.expanduser('~'), '.blockstack-cli')
+        self.zonefile_cache_mb = 64
+        self.tracer = None
+        self.transport = 'threads'
+        self.cache = False
+        self.adaptive = False
+        self.rate = None
+        self.records = None
+        self._client = None
+        self._zonefiles = None
+
+    @property
+    def client(self):
+        # one client, and so one keep-alive pool, per process, shared by every command (and every line of `batch`)
+        if self._client is None:
+            key = (self.host, self.password, self.method, self.pool_size, self.hedge, self.adaptive, self.rate)
+            if WARM_CLIENTS is not None and self.tracer is None and key in WARM_CLIENTS:
+                # a command forwarded to `serve`, picking up the pool an earlier one left open
+                self._client = WARM_CLIENTS[key]
+                self._client.cache = None
+            else:
+                self._client = BlockstackClient(self.host, self.password, self.method == 'https://', self.pool_size, self.hedge, self.tracer)
+                if self.adaptive or self.rate:
+                    self._client.admission = AdmissionController(self.pool_size, self.adaptive, self.rate)
+                # a traced run gets a cold client of its own, so its connect phases are real
+                if WARM_CLIENTS is not None and self.tracer is None:
+                    WARM_CLIENTS[key] = self._client
+            if self.cache:
+                self.response_cache(CACHEABLE_PATHS[read] for read in CACHED_READS)
+        return self._client
+
+    def ensure_pool(self, size):
+        self.client.ensure_pool(size)
+
+    def report_admission(self):
+        if self._client is not None and self._client.admission is not None and self._client.admission.hosts:
+            click.echo("Adaptive limits: {}".format(self._client.admission.report()), err=True)
+
+    def response_cache(self, patterns):
+        """the client's ResponseCache, opened on first use and widened to PATTERNS"""
+        client = self.client
+        if client.cache is None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # nothing is asked of the node until the first cacheable read
+            client.cache = ResponseCache(os.path.join(self.cache_dir, 'responses.db'), [], lambda: client.get_consensus().get('consensus_hash'))
+            click.get_current_context().find_root().call_on_close(client.cache.close)
+        client.cache.patterns.extend(p for p in patterns if p not in client.cache.patterns)
+        return client.cache
+
+    @property
+    def zonefiles(self):
+        if self._zonefiles is None:
+            self._zonefiles = BlobStore(os.path.join(self.cache_dir, 'zonefiles'), self.zonefile_cache_mb * 1024 * 1024)
+        return self._zonefiles
 
 pass_config = click.make_pass_decorator(Config, ensure=True)
 
+# clients by connection settings, kept across commands while `serve` runs, None otherwise
+WARM_CLIENTS = None
+
 # HELPER METHODS
-def create_url(config, path):
-    return "{}{}{}".format(config.method,config.host,path)
+def make_session(pool_size, tracer=None):
+    import requests
+    session = requests.Session()
+    if tracer is None:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    else:
+        adapter = make_traced_adapter(tracer, pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+TRACE_PHASES = ['dns', 'connect', 'tls', 'ttfb', 'download', 'decode', 'format']
+# who to blame for a slow run: the node answering, the network in between, or the CLI itself
+TRACE_BLAME = [('node', ['ttfb']), ('network', ['dns', 'connect', 'tls', 'download']), ('cli', ['decode', 'format'])]
 
-def make_headers(config):
-    return {'Authorization': 'bearer {}'.format(config.password), 'Origin': 'http://localhost:3000', 'Content-Type': 'application/json'}
+class Tracer(object):
+    """per request timings, split into the TRACE_PHASES, for --trace
 
-def make_debug_headers(config):
-    return {'Authorization': 'bearer {}'.format(config.password), 'Origin': 'http://localhost:3000', 'Content-Type': 'application/json'}
+    dns, connect and tls are only known for requests that opened a new connection,
+    requests reusing a keep-alive connection leave them as None.
+    """
+
+    def __init__(self):
+        import array
+        import threading
+        self.records = []
+        self.local = threading.local()
+        # seconds spent writing each record of a streaming command, which belongs to the run
+        # rather than to any one request
+        self.streamed = array.array('d')
+
+    def timed(self, fn, *args):
+        import time
+        start = time.time()
+        try:
+            return fn(*args)
+        finally:
+            self.streamed.append(time.time() - start)
+
+    def connection(self):
+        # the traced connection classes write into the timings of the request running on their thread
+        return getattr(self.local, 'timings', {})
+
+    def request(self, session, method, url, **kwargs):
+        import time
+        import requests
+        self.local.timings = timings = {}
+        start = time.time()
+        record = {'time': round(start, 3), 'method': method, 'url': url}
+        try:
+            r = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            record['error'] = str(e)
+            record['total'] = time.time() - start
+            self.records.append(dict(record, **timings))
+            raise
+        total = time.time() - start
+        # requests stops its clock once the headers are in, so the rest of total is the body
+        elapsed = r.elapsed.total_seconds()
+        opening = sum(timings.get(phase) or 0 for phase in ('dns', 'connect', 'tls'))
+        record.update(timings, status=r.status_code, bytes=len(r.content), reused='connect' not in timings,
+                      ttfb=max(0.0, elapsed - opening), download=max(0.0, total - elapsed), total=total)
+        self.records.append(record)
+        r.trace = record
+        return r
+
+    def stats(self, phase):
+        samples = [r[phase] for r in self.records if r.get(phase) is not None]
+        if phase == 'format':
+            samples.extend(self.streamed)
+        samples.sort()
+        if not samples:
+            return None
+        pick = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))]
+        return {'count': len(samples), 'sum': sum(samples), 'p50': pick(0.5), 'p95': pick(0.95), 'max': samples[-1]}
+
+    def summary(self):
+        errors = len([r for r in self.records if 'error' in r])
+        streamed = sum(self.streamed)
+        total = sum(r['total'] for r in self.records) + streamed
+        lines = ["trace: {} requests, {} failed, {:.1f} ms".format(len(self.records), errors, total * 1000),
+                 "{:<10} {:>7} {:>10} {:>10} {:>10} {:>10}".format('phase', 'count', 'total ms', 'p50 ms', 'p95 ms', 'max ms')]
+        for phase in TRACE_PHASES:
+            stats = self.stats(phase)
+            if stats:
+                lines.append("{:<10} {:>7} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                    phase, stats['count'], stats['sum'] * 1000, stats['p50'] * 1000, stats['p95'] * 1000, stats['max'] * 1000))
+        spent = [(who, sum(r.get(p) or 0 for r in self.records for p in phases) + (streamed if 'format' in phases else 0))
+                 for who, phases in TRACE_BLAME]
+        if total:
+            lines.append(', '.join("{} {:.0f}%".format(who, seconds * 100 / total) for who, seconds in spent))
+        return '\n'.join(lines) + '\n'
+
+    def jsonl(self):
+        import json
+        # phases in ms like the summary, time stays a unix timestamp
+        timed = frozenset(TRACE_PHASES + ['total'])
+        ms = lambda k, v: round(v * 1000, 3) if k in timed and v is not None else v
+        lines = [json.dumps(dict((k, ms(k, v)) for k, v in r.items()), sort_keys=True) + '\n' for r in self.records]
+        if self.streamed:
+            lines.append(json.dumps({'records': len(self.streamed), 'format': ms('format', sum(self.streamed))}, sort_keys=True) + '\n')
+        return ''.join(lines)
+
+    def prom(self):
+        """prometheus text exposition format, for the node exporter textfile collector"""
+        lines = ["# HELP blockstack_cli_request_phase_seconds time spent in each phase of an api request",
+                 "# TYPE blockstack_cli_request_phase_seconds summary"]
+        for phase in TRACE_PHASES:
+            stats = self.stats(phase)
+            if stats:
+                for quantile, key in (('0.5', 'p50'), ('0.95', 'p95')):
+                    lines.append('blockstack_cli_request_phase_seconds{{phase="{}",quantile="{}"}} {:.6f}'.format(phase, quantile, stats[key]))
+                lines.append('blockstack_cli_request_phase_seconds_sum{{phase="{}"}} {:.6f}'.format(phase, stats['sum']))
+                lines.append('blockstack_cli_request_phase_seconds_count{{phase="{}"}} {}'.format(phase, stats['count']))
+        counts = collections.Counter((r['method'], str(r.get('status', 'error'))) for r in self.records)
+        lines += ["# HELP blockstack_cli_requests_total api requests sent, by method and status",
+                  "# TYPE blockstack_cli_requests_total counter"]
+        for (method, status), count in sorted(counts.items()):
+            lines.append('blockstack_cli_requests_total{{method="{}",status="{}"}} {}'.format(method, status, count))
+        return '\n'.join(lines) + '\n'
+
+    def report(self, fmt, path=None):
+        text = getattr(self, fmt)()
+        if path is None:
+            click.echo(text, err=True, nl=False)
+            return
+        import tempfile
+        # write then rename, so a collector scraping the directory never reads half a file
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.trace-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.rename(tmp, path)
+
+def trace_phase(record, phase, fn, *args):
+    """call fn(*args), adding its run time to PHASE of a --trace RECORD"""
+    import time
+    start = time.time()
+    try:
+        return fn(*args)
+    finally:
+        seconds = time.time() - start
+        record[phase] = (record.get(phase) or 0) + seconds
+        record['total'] += seconds
+
+def make_traced_adapter(tracer, pool_size):
+    """an HTTPAdapter whose connections time name resolution, the TCP connect and the TLS handshake"""
+    import socket
+    import time
+    import requests
+    from requests.packages.urllib3 import connection, connectionpool
+
+    def new_conn(conn, base):
+        timings = tracer.connection()
+        start = time.time()
+        dns_host = conn._dns_host
+        try:
+            address = socket.getaddrinfo(dns_host, conn.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except socket.error:
+            # let urllib3 fail the lookup again, so the error comes out the way requests expects
+            return base._new_conn(conn)
+        resolved = time.time()
+        conn._dns_host = address
+        try:
+            sock = base._new_conn(conn)
+        finally:
+            conn._dns_host = dns_host
+        timings['dns'] = resolved - start
+        timings['connect'] = time.time() - resolved
+        return sock
+
+    def connect(conn, base, tls):
+        timings = tracer.connection()
+        start = time.time()
+        base.connect(conn)
+        if tls:
+            timings['tls'] = max(0.0, time.time() - start - (timings.get('dns') or 0) - (timings.get('connect') or 0))
+
+    class TracedHTTPConnection(connection.HTTPConnection):
+        def _new_conn(self):
+            return new_conn(self, connection.HTTPConnection)
+
+        def connect(self):
+            connect(self, connection.HTTPConnection, False)
+
+    class TracedHTTPSConnection(connection.HTTPSConnection):
+        def _new_conn(self):
+            return new_conn(self, connection.HTTPSConnection)
+
+        def connect(self):
+            connect(self, connection.HTTPSConnection, True)
+
+    class TracedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+        ConnectionCls = TracedHTTPConnection
+
+    class TracedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+        ConnectionCls = TracedHTTPSConnection
+
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    adapter.poolmanager.pool_classes_by_scheme = {'http': TracedHTTPConnectionPool, 'https': TracedHTTPSConnectionPool}
+    return adapter
 
 def json_out(r):
+    import json
     return json.dumps(r,sort_keys=True, indent=4, separators=(',', ': '))
 
-def output(config, url, r):
+def ndjson_out(r):
+    import json
+    return json.dumps(r, separators=(',', ':'))
+
+def yaml_out(r):
+    import yaml
+    return yaml.safe_dump(r, default_flow_style=False)
+
+def toml_out(r):
+    import toml
+    return toml.dumps(r)
+
+FORMATTERS = {
+    'json': json_out,
+    'ndjson': ndjson_out,
+    'yaml': yaml_out,
+    'toml': toml_out,
+}
+
+# --fmt choices that write one line per record rather than formatting a whole document
+RECORD_FORMATS = ['csv', 'table']
+
+# rows a table holds back to size its columns, later rows keep those widths
+TABLE_SAMPLE_ROWS = 100
+
+WHERE_RE = re.compile(r'\s*([^\s=!<>~]+)\s*(==|!=|>=|<=|>|<|~)\s*(.*?)\s*$')
+
+Where = collections.namedtuple('Where', ['path', 'op', 'value'])
+
+def parse_where(expr):
+    """a --where FIELD OP VALUE, VALUE read as JSON (numbers, true, null, "quoted") and as a bare string otherwise"""
+    import json
+    m = WHERE_RE.match(expr)
+    if m is None:
+        raise click.BadParameter("expected FIELD OP VALUE with OP one of == != > >= < <= ~, got {}".format(expr), param_hint='--where')
+    path, op, value = m.groups()
+    if op == '~':
+        try:
+            value = re.compile(value)
+        except re.error as e:
+            raise click.BadParameter("bad regular expression {}: {}".format(value, e), param_hint='--where')
+    else:
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+    return Where(path, op, value)
+
+def field_value(record, path):
+    """the value at the dotted PATH of RECORD, list items by index, None where there is nothing"""
+    value = record
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and re.match(r'-?\d+$', part) and -len(value) <= int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+def where_matches(where, record):
+    import numbers
+    import operator
+    value = field_value(record, where.path)
+    if where.op == '~':
+        text = value if isinstance(value, (str, type(u''))) else u'{}'.format(value)
+        return value is not None and where.value.search(text) is not None
+    if where.op == '==':
+        return value == where.value
+    if where.op == '!=':
+        return value != where.value
+    # only numbers against numbers and strings against strings, never python 2's anything-goes ordering
+    strings = (str, type(u''))
+    if not ((isinstance(value, numbers.Number) and isinstance(where.value, numbers.Number)) or
+            (isinstance(value, strings) and isinstance(where.value, strings))):
+        return False
+    return {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}[where.op](value, where.value)
+
+def table_cell(value):
+    import json
+    if value is None:
+        return u''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return u'{}'.format(value)
+
+class RecordWriter(object):
+    """--fields, --where and the csv and table formats, applied to each record on its way out
+
+    A response that is a list gives one record per entry, anything else is one record;
+    plain values, like the names on a page, are records with the single field `value`.
+    """
+
+    def __init__(self, fmt, fields, wheres):
+        self.fmt = fmt
+        self.fields = fields
+        self.wheres = wheres
+        self.columns = fields
+        self.csv = None
+        self.pending = []
+        self.widths = None
+
+    def keep(self, record):
+        """RECORD cut down to --fields, or None when a --where rules it out"""
+        if not isinstance(record, dict):
+            record = {'value': record}
+        # any(), since `all` is the `namespace all` command in this module
+        if any(not where_matches(where, record) for where in self.wheres):
+            return None
+        if self.fields:
+            record = collections.OrderedDict((field, field_value(record, field)) for field in self.fields)
+        return record
+
+    def output(self, data, records=None):
+        """write a whole response, RECORDS(data) picking out its records when a list of them is not the body"""
+        items = records(data) if records else (data if isinstance(data, list) else [data])
+        if self.fmt in RECORD_FORMATS or self.fmt == 'ndjson':
+            for item in items:
+                self.write(item)
+            return
+        kept = [record for record in (self.keep(item) for item in items) if record is not None]
+        if isinstance(data, list) or records:
+            click.echo(FORMATTERS[self.fmt](kept))
+        elif kept:
+            click.echo(FORMATTERS[self.fmt](kept[0]))
+
+    def write(self, record):
+        record = self.keep(record)
+        if record is None:
+            return
+        if self.columns is None:
+            self.columns = sorted(record)
+        if self.fmt == 'csv':
+            self.write_csv(record)
+        elif self.fmt == 'table':
+            self.write_table(record)
+        else:
+            click.echo(ndjson_out(record))
+
+    def write_csv(self, record):
+        if self.csv is None:
+            # the py2 csv module only writes byte strings
+            self.buffer = io.BytesIO() if sys.version_info[0] == 2 else io.StringIO()
+            self.csv = CSVExport(self.buffer, self.columns)
+        self.csv.write([record])
+        click.echo(self.buffer.getvalue(), nl=False)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def write_table(self, record):
+        self.pending.append([table_cell(record.get(column)) for column in self.columns])
+        if self.widths is not None:
+            self.flush_table()
+        elif len(self.pending) >= TABLE_SAMPLE_ROWS:
+            self.flush_table()
+
+    def flush_table(self):
+        rows = self.pending
+        self.pending = []
+        if self.widths is None:
+            rows = [[u'{}'.format(column) for column in self.columns]] + rows
+            self.widths = [max(len(row[i]) for row in rows) for i in range(len(self.columns))]
+        for row in rows:
+            click.echo(u'  '.join(cell.ljust(width) for cell, width in zip(row, self.widths)).rstrip())
+
+    def close(self):
+        if self.fmt == 'table' and self.pending:
+            self.flush_table()
+
+def write_record(config, record, sort_keys=False):
+    """write one record of a streaming command, an NDJSON line unless --fields, --where or csv/table reshape it"""
+    if config.tracer is not None:
+        return config.tracer.timed(_write_record, config, record, sort_keys)
+    _write_record(config, record, sort_keys)
+
+def _write_record(config, record, sort_keys):
+    import json
+    if config.records is None:
+        click.echo(json.dumps(record, sort_keys=sort_keys))
+    else:
+        config.records.write(record)
+
+def write_totals(config, totals, sort_keys=False):
+    if config.tracer is not None:
+        return config.tracer.timed(_write_totals, config, totals, sort_keys)
+    _write_totals(config, totals, sort_keys)
+
+def _write_totals(config, totals, sort_keys):
+    import json
+    # not a record, so it steps out of the way of projected, csv and table output
+    click.echo(json.dumps(totals, sort_keys=sort_keys), err=config.records is not None)
+
+def decode_json(r):
+    trace = getattr(r, 'trace', None)
+    if trace is None:
+        return r.json()
+    return trace_phase(trace, 'decode', r.json)
+
+def output(config, r, records=None):
     if config.debug:
-        click.echo("Request URL: {} {}".format(r.request.method, url))
-        click.echo("Request Headers:\n{}".format(json_out(make_debug_headers(config))))
+        click.echo("Request URL: {} {}".format(r.request.method, r.request.url))
+        click.echo("Request Headers:")
+        for key, value in r.request.headers.items():
+            click.echo("    {}: {}".format(key, value))
         if r.request.body:
-            click.echo("Request Payload:\n{}".format(json_out(json.loads(r.request.body))))
+            body = r.request.body
+            click.echo("Request Payload:\n{}".format(body.decode('utf-8', 'replace') if isinstance(body, bytes) else body))
         click.echo("Response Code: {}".format(r.status_code))
+        if getattr(r, 'from_cache', False):
+            click.echo("Response from local cache for consensus hash {}".format(config.client.cache.epoch))
         click.echo("Response Body ({}):".format(config.fmt))
     
-    if config.fmt == "json":
-        if r.text:
-            click.echo(json_out(r.json()))
-    elif config.fmt == "yaml":
-        if r.text:
-            click.echo(yaml.safe_dump(r.json(), default_flow_style=False))
-    elif config.fmt == "toml":
-        if r.text:
-            click.echo(toml.dumps(r.json()))
+    body = r.content.strip()
+    if not body:
+        return
+    # a compact JSON body is already a valid NDJSON line, so skip the decode/encode round trip
+    if config.fmt == "ndjson" and config.records is None and b"\n" not in body and 'json' in r.headers.get('Content-Type', ''):
+        click.echo(body)
+        return
+    trace = getattr(r, 'trace', None)
+    output_data(config, decode_json(r), trace, records)
+    if config.debug and trace is not None:
+        click.echo("Timings (ms): {}".format(', '.join("{} {:.2f}".format(phase, trace[phase] * 1000) for phase in TRACE_PHASES if trace.get(phase) is not None)))
+
+def output_data(config, data, trace=None, records=None):
+    if config.records is not None:
+        return config.records.output(data, records)
+    formatter = FORMATTERS[config.fmt]
+    if trace is None:
+        click.echo(formatter(data))
     else:
-        click.echo("not a supported output format")
+        click.echo(trace_phase(trace, 'format', formatter, data))
 
-# Default Configuration
-default_config = {
-  'subdomain-resolution': {
-    'subdomains_db': '{}.blockstack/subdomains.db'.format(os.environ["HOME"]),
-  },
-  'blockstack-client': {
-    'api_endpoint_host': 'localhost',
-    'blockchain_writer': 'blockstack_utxo',
-    'api_endpoint_port': '6270',
-    'api_password': '{}'.format(os.urandom(32).encode('base-64')[:-2]),
-    'poll_interval': '300',
-    'server': 'node.blockstack.org',
-    'email': '',
-    'metadata': 'metadata',
-    'storage_drivers_required_write': 'disk,dropbox',
-    'queue_path': '{}.blockstack/queues.db'.format(os.environ["HOME"]),
-    'storage_drivers': 'disk,dropbox,s3,blockstack_resolver,blockstack_server,http,dht',
-    'blockchain_reader': 'blockstack_utxo',
-    'client_version': '0.14.4.2',
-    'api_endpoint_bind': 'localhost',
-    'port': 6264,
-    'anonymous_statistics': True,
-  },
-  'bitcoind': {
-    'passwd': 'blockstacksystem',
-    'regtest': 'False',
-    'spv_path': '{}.virtualchain-spv-headers.dat'.format(os.environ["HOME"]),
-    'server': 'bitcoin.blockstack.com',
-    'p2p_port': '8333',
-    'user': 'blockstack',
-    'timeout': '300',
-    'port': '8332',
-  },
-  'blockstack': {
-    'server': 'node.blockstack.org',
-  },
-  'blockchain-writer': {
-    'url': 'https://utxo.blockstack.org',
-    'utxo_provider': 'blockstack_utxo',
-  },
-  'blockchain-reader': {
-    'url': 'https://utxo.blockstack.org',
-    'utxo_provider': 'blockstack_utxo',
-  },
+def output_cached_zonefile(config, zonefile_hash):
+    data = config.zonefiles.get(zonefile_hash)
+    if data is None:
+        return False
+    if config.debug:
+        click.echo("Response Body ({}): from local zonefile cache {}".format(config.fmt, config.zonefiles.root))
+    output_data(config, {'zonefile': data.decode('utf-8')})
+    return True
+
+def cache_zonefile(config, zonefile_hash, r):
+    if r.ok and r.text:
+        zonefile = r.json().get('zonefile')
+        if zonefile is not None:
+            config.zonefiles.put(zonefile_hash, zonefile.encode('utf-8'))
+
+def bounded_map(fn, items, workers, ordered=False):
+    """yield fn(item) for each item, keeping at most 2 * workers calls queued or in flight"""
+    from concurrent import futures
+    items = iter(items)
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        inflight = collections.deque(pool.submit(fn, item) for item in itertools.islice(items, workers * 2))
+        while inflight:
+            if ordered:
+                done = inflight.popleft()
+            else:
+                futures.wait(inflight, return_when=futures.FIRST_COMPLETED)
+                done = next(f for f in inflight if f.done())
+                inflight.remove(done)
+            for item in itertools.islice(items, 1):
+                inflight.append(pool.submit(fn, item))
+            yield done.result()
+
+def fetch_map(config, fetch, items, workers, ordered=False):
+    """yield (item, response, error) for fetch(item, raw=True) over ITEMS, WORKERS requests in flight
+
+    fetch is a client endpoint method, or a functools.partial of one holding its leading
+    arguments. With --transport asyncio the requests run as coroutines on one event loop
+    instead of a thread each.
+    """
+    if config.transport == 'asyncio':
+        import cli_aio
+        return cli_aio.fetch_map(config.client, fetch, items, workers, ordered)
+    import requests
+    config.ensure_pool(workers)
+    def attempt(item):
+        try:
+            return item, fetch(item, raw=True), None
+        except requests.RequestException as e:
+            return item, None, e
+    return bounded_map(attempt, items, workers, ordered)
+
+def find_last_page(fetch):
+    """gallop then bisect for the last non-empty page, O(log n) requests instead of a serial walk"""
+    if not fetch(0):
+        return -1
+    lo, hi = 0, 1
+    while fetch(hi):
+        lo, hi = hi, hi * 2
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if fetch(mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+def iter_pages(config, fetch, workers, ordered=False, last_page=None):
+    """yield every entry of every page, fetch(page) returning the list of entries on that page"""
+    if last_page is None:
+        last_page = find_last_page(fetch)
+    pages = itertools.islice(itertools.count(), last_page + 1)
+    for page, r, error in fetch_map(config, fetch, pages, workers, ordered):
+        if error is not None:
+            raise error
+        if not r.ok:
+            raise BlockstackAPIError(r)
+        for entry in decode_json(r):
+            yield entry
+
+def stream_pages(config, fetch, workers, ordered):
+    for entry in iter_pages(config, fetch, workers, ordered):
+        write_record(config, entry)
+
+# columns namespace export can add after the name, and the lookup that fills each one
+EXPORT_COLUMNS = collections.OrderedDict([
+    ('address', 'get_name'),
+    ('zonefile_hash', 'get_name'),
+    ('history_depth', 'get_name_history'),
+])
+
+def chunked(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+def history_records(history):
+    """a name history, which maps block heights to the operations in them, as one record per operation"""
+    for height in sorted(history, key=lambda h: int(h) if h.isdigit() else h):
+        ops = history[height]
+        for op in ops if isinstance(ops, list) else [ops]:
+            record = {'block': int(height) if height.isdigit() else height}
+            record.update(op if isinstance(op, dict) else {'value': op})
+            yield record
+
+def history_depth(history):
+    """the number of operations in a name's history, which maps block heights to the operations in them"""
+    return sum(len(ops) if isinstance(ops, list) else 1 for ops in history.values())
+
+def export_row_groups(config, tld, columns, workers, row_group):
+    """yield every name in TLD with its COLUMNS filled in, as lists of at most ROW_GROUP rows"""
+    names = iter_pages(config, functools.partial(config.client.get_namespace_names, tld), workers, ordered=True)
+    methods = [m for m in ('get_name', 'get_name_history') if m in [EXPORT_COLUMNS[c] for c in columns]]
+    for chunk in chunked(names, row_group):
+        rows = collections.OrderedDict((name, {'name': name}) for name in chunk)
+        for method in methods:
+            for name, r, error in fetch_map(config, getattr(config.client, method), chunk, workers):
+                record = lookup('name', name, r, error)
+                if 'error' in record:
+                    rows[name]['error'] = str(record['error'])
+                elif method == 'get_name':
+                    rows[name].update(address=record['result'].get('address'), zonefile_hash=record['result'].get('zonefile_hash'))
+                else:
+                    rows[name]['history_depth'] = history_depth(record['result'])
+        yield list(rows.values())
+
+class CSVExport(object):
+    """namespace export --format csv, a header line then one line per name"""
+    mode = 'w'
+
+    def __init__(self, f, columns):
+        import csv
+        self.columns = columns
+        self.writer = csv.writer(f, lineterminator='\n')
+        self.writer.writerow(columns)
+
+    def cell(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, (dict, list)):
+            return table_cell(value)
+        # the py2 csv module only writes byte strings
+        if sys.version_info[0] == 2 and isinstance(value, type(u'')):
+            return value.encode('utf-8')
+        return value
+
+    def write(self, rows):
+        self.writer.writerows([self.cell(row.get(c)) for c in self.columns] for row in rows)
+
+    def close(self):
+        pass
+
+class ParquetExport(object):
+    """namespace export --format parquet, one parquet row group per ROW_GROUP names"""
+    mode = 'wb'
+
+    def __init__(self, f, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise click.UsageError("--format parquet needs pyarrow, pip install 'blockstack-cli[parquet]'")
+        self.pyarrow = pyarrow
+        self.columns = columns
+        self.schema = pyarrow.schema([(c, pyarrow.int64() if c == 'history_depth' else pyarrow.string()) for c in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(f, self.schema)
+
+    def write(self, rows):
+        table = self.pyarrow.Table.from_pydict(dict((c, [row.get(c) for row in rows]) for c in self.columns), schema=self.schema)
+        self.writer.write_table(table, row_group_size=len(rows))
+
+    def close(self):
+        self.writer.close()
+
+EXPORT_FORMATS = {'csv': CSVExport, 'parquet': ParquetExport}
+
+def export_namespace(config, tld, fmt, path, columns, workers, row_group):
+    """write every name in TLD to PATH (STDOUT when None) in FMT, holding one row group in memory at a time"""
+    import tempfile
+    writer = EXPORT_FORMATS[fmt]
+    header = ['name'] + columns + (['error'] if columns else [])
+    if path is None:
+        f = click.get_binary_stream('stdout') if 'b' in writer.mode else click.get_text_stream('stdout')
+    else:
+        # write then rename, so an export that dies halfway never looks like a finished one
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.export-')
+        # mkstemp makes the file private, an export gets the permissions any new file would
+        umask = os.umask(0)
+        os.umask(umask)
+        os.fchmod(fd, 0o666 & ~umask)
+        f = os.fdopen(fd, writer.mode)
+    count, errors = 0, 0
+    try:
+        out = writer(f, header)
+        for rows in export_row_groups(config, tld, columns, workers, row_group):
+            out.write(rows)
+            count += len(rows)
+            errors += sum(1 for row in rows if 'error' in row)
+        out.close()
+        if path is not None:
+            f.close()
+            os.rename(tmp, path)
+    except BaseException:
+        if path is not None:
+            f.close()
+            os.remove(tmp)
+        raise
+    click.echo("exported {} names from .{}{}".format(count, tld, ", {} lookups failed".format(errors) if errors else ''), err=True)
+
+# RIPEMD-160 round constants, used when hashlib's OpenSSL build leaves ripemd160 out
+RMD_ML = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
+          3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12, 1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
+          4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13]
+RMD_MR = [5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12, 6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
+          15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13, 8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
+          12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11]
+RMD_RL = [11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8, 7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
+          11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5, 11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
+          9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6]
+RMD_RR = [8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6, 9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
+          9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5, 15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
+          8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11]
+RMD_KL = [0, 0x5a827999, 0x6ed9eba1, 0x8f1bbcdc, 0xa953fd4e]
+RMD_KR = [0x50a28be6, 0x5c4dd124, 0x6d703ef3, 0x7a6d76e9, 0]
+
+def _rmd_f(x, y, z, i):
+    if i == 0:
+        return x ^ y ^ z
+    elif i == 1:
+        return (x & y) | (~x & z)
+    elif i == 2:
+        return (x | ~y) ^ z
+    elif i == 3:
+        return (x & z) | (y & ~z)
+    return x ^ (y | ~z)
+
+def _rmd_rol(x, i):
+    return ((x << i) | ((x & 0xffffffff) >> (32 - i))) & 0xffffffff
+
+def _rmd_compress(state, block):
+    al, bl, cl, dl, el = state
+    ar, br, cr, dr, er = state
+    x = struct.unpack('<16L', block)
+    for j in range(80):
+        rnd = j >> 4
+        al = _rmd_rol(al + _rmd_f(bl, cl, dl, rnd) + x[RMD_ML[j]] + RMD_KL[rnd], RMD_RL[j]) + el
+        al, bl, cl, dl, el = el, al, bl, _rmd_rol(cl, 10), dl
+        ar = _rmd_rol(ar + _rmd_f(br, cr, dr, 4 - rnd) + x[RMD_MR[j]] + RMD_KR[rnd], RMD_RR[j]) + er
+        ar, br, cr, dr, er = er, ar, br, _rmd_rol(cr, 10), dr
+    h0, h1, h2, h3, h4 = state
+    return (h1 + cl + dr, h2 + dl + er, h3 + el + ar, h4 + al + br, h0 + bl + cr)
+
+def ripemd160(data):
+    import hashlib
+    try:
+        return hashlib.new('ripemd160', data).digest()
+    except ValueError:
+        pass
+    state = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0)
+    padded = data + b"\x80" + b"\0" * ((119 - len(data)) & 63) + struct.pack('<Q', 8 * len(data))
+    for i in range(0, len(padded), 64):
+        state = _rmd_compress(state, padded[i:i + 64])
+    return struct.pack('<5L', *[h & 0xffffffff for h in state])
+
+def hash160(data):
+    import hashlib
+    return ripemd160(hashlib.sha256(data).digest())
+
+# a full zonefile cache is evicted down to this fraction of its cap
+BLOB_LOW_WATER = 0.9
+
+class BlobStore(object):
+    """content-addressed zonefile store, blobs live at ROOT/<hash[:2]>/<hash> and are evicted least recently used first"""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._total = None
+
+    def _path(self, digest):
+        digest = digest.lower()
+        if not re.match(r'^[0-9a-f]{40}$', digest):
+            return None
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _blobs(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                st = os.stat(path)
+                yield st.st_mtime, st.st_size, path
+
+    def get(self, digest):
+        path = self._path(digest)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        # mtime doubles as the LRU clock
+        os.utime(path, None)
+        return data
+
+    def put(self, digest, data):
+        """store DATA under DIGEST, refusing it unless DIGEST is its hash160"""
+        path = self._path(digest)
+        if path is None or binascii.hexlify(hash160(data)).decode('ascii') != digest.lower():
+            return False
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        import tempfile
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self._blobs())
+        else:
+            self._total += len(data)
+        if self._total > self.max_bytes:
+            self.evict()
+        return True
+
+    def evict(self):
+        blobs = sorted(self._blobs())
+        self._total = sum(size for _, size, _ in blobs)
+        # leave headroom below the cap, so a full store walks and sorts itself once per tenth of the cap written, not on every put
+        target = self.max_bytes * BLOB_LOW_WATER
+        for _, size, path in blobs:
+            if self._total <= target:
+                break
+            os.remove(path)
+            self._total -= size
+
+RESPONSE_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, status_code INTEGER, content_type TEXT, body BLOB);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# reads whose answer can only change when a new block moves the consensus hash
+CACHEABLE_PATHS = {
+    'name': re.compile(r'^/v1/names/[^/]+$'),
+    'name_history': re.compile(r'^/v1/names/[^/]+/history$'),
+    'names_page': re.compile(r'^/v1/names$'),
+    'names_owned': re.compile(r'^/v1/addresses/[^/]+/[^/]+$'),
+    'namespace_names': re.compile(r'^/v1/namespaces/[^/]+/names$'),
+    'utxo': re.compile(r'^/v1/blockchains/[^/]+/[^/]+/unspent$'),
 }
+# reads every node answers alike from the chain, so with several --host they may go to
+# whichever is fastest; node, wallet and registrar state stays on the first host, the one
+# that takes the writes, and so do a node's own mempool and consensus hash, which differ
+# between nodes at different heights and would flip --watch and the --cache epoch
+ROUTED_PATHS = re.compile(r'^/v1/(?!blockchains/[^/]+/(pending|consensus)$)(names|namespaces|prices|addresses|blockchains)(/|$)')
+# what --cache covers, UTXO sweeps cache on their own
+CACHED_READS = ['name', 'name_history', 'names_page', 'names_owned', 'namespace_names']
+# long running commands (batch, watch) ask for the consensus hash again this often
+EPOCH_CHECK_SECONDS = 30
+
+class ResponseCache(object):
+    """GET responses kept on disk for one consensus hash, all dropped once the chain moves past it
+
+    Only paths matching one of PATTERNS are kept, shared by every --host since nodes at the
+    same consensus hash answer the same way. Server errors are never kept.
+    """
+
+    def __init__(self, path, patterns, consensus):
+        import threading
+        self.path = path
+        self.patterns = list(patterns)
+        self.consensus = consensus
+        self.epoch = None
+        self.hits = 0
+        self.db = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        self._epoch_lock = threading.Lock()
+        self._pending = 0
+
+    def current(self):
+        """open the store and empty it unless it holds the node's current consensus hash"""
+        import sqlite3
+        import time
+        with self._epoch_lock:
+            if self.db is not None and time.time() - self._checked < EPOCH_CHECK_SECONDS:
+                return
+            epoch = self.consensus()
+            with self._lock:
+                if self.db is None:
+                    # the thread transport reads and writes from its worker threads, serialised by _lock
+                    self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                    self.db.executescript(RESPONSE_CACHE_SCHEMA)
+                row = self.db.execute("SELECT value FROM meta WHERE key = 'consensus_hash'").fetchone()
+                if row is None or row[0] != epoch:
+                    self.db.execute("DELETE FROM responses")
+                    self.db.execute("INSERT OR REPLACE INTO meta VALUES ('consensus_hash', ?)", (epoch,))
+                    self.db.commit()
+                    self._pending = 0
+                self.epoch = epoch
+                self._checked = time.time()
+
+    def key(self, path, params=None):
+        if not any(pattern.match(path) for pattern in self.patterns):
+            return None
+        if params:
+            return path + '?' + '&'.join("{}={}".format(k, v) for k, v in sorted(params.items()))
+        return path
+
+    def get(self, key, url, headers):
+        """the cached answer for KEY as a requests.Response, or None"""
+        self.current()
+        with self._lock:
+            row = self.db.execute("SELECT status_code, content_type, body FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        import datetime
+        import requests
+        r = requests.Response()
+        r.status_code, r._content = row[0], bytes(row[2])
+        r.headers['Content-Type'] = row[1]
+        r.encoding = 'utf-8'
+        r.url = url
+        r.request = requests.Request('GET', url, headers=headers).prepare()
+        r.elapsed = datetime.timedelta(0)
+        r.from_cache = True
+        self.hits += 1
+        return r
+
+    def put(self, key, r):
+        if r.status_code >= 500:
+            return
+        import sqlite3
+        self.current()
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                            (key, r.status_code, r.headers.get('Content-Type', 'application/json'), sqlite3.Binary(r.content)))
+            # a sweep stores thousands of answers, so commit in batches rather than one fsync each
+            self._pending += 1
+            if self._pending >= 500:
+                self.db.commit()
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if self.db is not None:
+                self.db.commit()
+                self.db.close()
+                self.db = None
+
+def read_lines(f):
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+def lookup(label, key, r, error):
+    """wrap the outcome of one fetch_map request as an NDJSON-ready record, never raising for a single failure"""
+    record = {label: key}
+    if error is not None:
+        record['error'] = str(error)
+        return record
+    record['status_code'] = r.status_code
+    try:
+        body = decode_json(r) if r.text else None
+    except ValueError as e:
+        record['error'] = str(e)
+        return record
+    if r.ok:
+        record['result'] = body
+    else:
+        record['error'] = body.get('error', body) if isinstance(body, dict) else body
+    return record
+
+def stream_lookups(config, label, keys, fetch, concurrency, ordered):
+    for key, r, error in fetch_map(config, fetch, keys, concurrency, ordered):
+        write_record(config, lookup(label, key, r, error))
+
+def sweep_utxos(config, blockchain, addresses, concurrency, ordered, min_confirmations):
+    """stream one NDJSON record of UTXOs and their total per address, then the totals over every address"""
+    totals = {'addresses': 0, 'utxos': 0, 'value': 0, 'errors': 0}
+    fetch = functools.partial(config.client.get_utxo, blockchain=blockchain)
+    for address, r, error in fetch_map(config, fetch, addresses, concurrency, ordered):
+        record = lookup('address', address, r, error)
+        totals['addresses'] += 1
+        if 'result' in record:
+            utxos = [u for u in record.pop('result') if u.get('confirmations', 0) >= min_confirmations]
+            record.update(utxos=utxos, count=len(utxos), value=sum(u.get('value', 0) for u in utxos))
+            totals['utxos'] += record['count']
+            totals['value'] += record['value']
+        else:
+            totals['errors'] += 1
+        write_record(config, record)
+    if config.client.cache is not None:
+        totals['cached'] = config.client.cache.hits
+    write_totals(config, {'totals': totals})
+
+# blockstack core refuses zonefiles bigger than this
+ZONEFILE_MAX_BYTES = 40960
+
+def zonefile_pairs(from_dir, manifest):
+    """yield (name, path) for every file in FROM_DIR, named NAME or NAME.zonefile, and every NAME PATH line of MANIFEST"""
+    if from_dir:
+        for filename in sorted(os.listdir(from_dir)):
+            path = os.path.join(from_dir, filename)
+            if not filename.startswith('.') and os.path.isfile(path):
+                yield re.sub(r'\.zonefile$', '', filename), path
+    if manifest:
+        # relative paths are relative to the manifest, unless it came on STDIN
+        base = os.path.dirname(os.path.abspath(manifest.name)) if os.path.isfile(manifest.name) else os.getcwd()
+        for line in read_lines(manifest):
+            parts = line.split(None, 1)
+            if len(parts) != 2:
+                raise click.UsageError("manifest lines are NAME PATH, got: {}".format(line))
+            yield parts[0], os.path.join(base, os.path.expanduser(parts[1]))
+
+def publish_zonefile(config, name, path, pending, dry_run):
+    """PUT the zonefile at PATH for NAME unless the name already points at it, as one NDJSON-ready record"""
+    import requests
+    record = {'name': name, 'zonefile': path}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(ZONEFILE_MAX_BYTES + 1)
+        if len(data) > ZONEFILE_MAX_BYTES:
+            raise ValueError("zonefile is over {} bytes".format(ZONEFILE_MAX_BYTES))
+        zonefile = data.decode('utf-8')
+        record['zonefile_hash'] = binascii.hexlify(hash160(data)).decode('ascii')
+        if name in pending:
+            # every update is a transaction, so never pay twice for one still in the registrar queue
+            record['status'] = 'pending'
+        elif config.client.get_name(name).get('zonefile_hash') == record['zonefile_hash']:
+            record['status'] = 'unchanged'
+        elif dry_run:
+            record['status'] = 'would_update'
+        else:
+            record['result'] = config.client.set_zonefile(name, zonefile)
+            record['status'] = 'updated'
+            config.zonefiles.put(record['zonefile_hash'], data)
+    except (IOError, OSError, ValueError, click.ClickException, requests.RequestException) as e:
+        record['status'] = 'error'
+        record['error'] = e.format_message() if isinstance(e, click.ClickException) else str(e)
+    return record
+
+def publish_zonefiles(config, pairs, concurrency, dry_run):
+    config.ensure_pool(concurrency)
+    pending = frozenset(registrar_queue(config.client))
+    totals = collections.Counter()
+    publish = lambda pair: publish_zonefile(config, pair[0], pair[1], pending, dry_run)
+    for record in bounded_map(publish, pairs, concurrency):
+        totals[record['status']] += 1
+        write_record(config, record)
+    write_totals(config, {'totals': dict(totals)})
+
+def registrar_queue(client):
+    """names with an operation still waiting in the node's registrar queue"""
+    return [entry.get('name') or entry.get('fqu') for entry in client.get_registrar_state() or [] if isinstance(entry, dict)]
+
+def name_cost(body):
+    """satoshis registering a name costs, from a /v1/prices/names answer"""
+    for key in ('total_estimated_cost', 'name_price'):
+        if isinstance(body, dict) and isinstance(body.get(key), dict) and 'satoshis' in body[key]:
+            return int(body[key]['satoshis'])
+    raise ValueError("no price in {}".format(body))
+
+class Journal(object):
+    """append-only JSON lines log of where each name of a bulk registration stands, replayed on resume
+
+    Every line is fsync'd before anything else happens, and an exclusive lock keeps two runs
+    from working off the same journal.
+    """
+
+    def __init__(self, path):
+        import json
+        self.path = path
+        self.last = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the line being written when the last run died
+                        continue
+                    self.last[record['name']] = record
+        self.f = open(path, 'a')
+        try:
+            import fcntl
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except ImportError:
+            pass
+        except (IOError, OSError):
+            raise click.ClickException("{} is in use by another run".format(path))
+        if self.f.tell() and not open(path, 'rb').read().endswith(b'\n'):
+            self.f.write('\n')
+
+    def state(self, name):
+        return self.last.get(name, {}).get('state')
+
+    def record(self, name, state, **fields):
+        import json
+        import time
+        record = dict(fields, name=name, state=state, time=round(time.time(), 3))
+        self.f.write(json.dumps(record, sort_keys=True) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.last[name] = record
+        return record
+
+    def close(self):
+        self.f.close()
+
+# polls a just submitted name may be missing from both the registrar queue and the chain
+SETTLE_GRACE_POLLS = 2
+
+def register_names(config, names, journal, max_price, max_queue, poll, confirmations, concurrency, wait, dry_run):
+    """take NAMES through availability, price, balance, paced submission and confirmation, as NDJSON"""
+    import time
+    import requests
+    client = config.client
+    outcome = collections.OrderedDict((name, journal.state(name)) for name in names)
+    def emit(record):
+        outcome[record['name']] = record['state']
+        write_record(config, record, sort_keys=True)
+    owner = client.get_owner_address().get('address')
+    # a dry run reports what it would settle without writing it down
+    settle = (lambda name, state, **fields: dict(fields, name=name, state=state)) if dry_run else journal.record
+
+    # a run that died between `submitting` and `submitted` can not know whether the node took the name,
+    # so settle it from the registrar queue and the chain, and never send it again when neither tells
+    queue = frozenset(registrar_queue(client))
+    for name in names:
+        if journal.state(name) == 'submitting':
+            if name in queue:
+                emit(settle(name, 'submitted', reconciled=True))
+                continue
+            r = client.get_name(name, raw=True)
+            if r.ok and decode_json(r).get('address') == owner:
+                emit(settle(name, 'confirmed', reconciled=True))
+            else:
+                emit(settle(name, 'unknown', error='interrupted while submitting, check the wallet before retrying'))
+
+    # names the node rejected outright were never submitted, so they go round again
+    todo = [name for name in names if journal.state(name) in (None, 'failed')]
+    available = []
+    for name, r, error in fetch_map(config, client.get_name, todo, concurrency, ordered=True):
+        if error is None and r.status_code == 404:
+            available.append(name)
+        elif error is None and r.ok:
+            emit({'name': name, 'state': 'taken'})
+        else:
+            emit({'name': name, 'state': 'error', 'error': lookup('name', name, r, error).get('error')})
+
+    priced = []
+    for name, r, error in fetch_map(config, client.get_name_price, available, concurrency, ordered=True):
+        record = lookup('name', name, r, error)
+        try:
+            cost = name_cost(record['result'])
+        except (KeyError, ValueError):
+            emit({'name': name, 'state': 'error', 'error': record.get('error', 'no price for this name')})
+            continue
+        if max_price is not None and cost > max_price:
+            emit({'name': name, 'state': 'too_expensive', 'satoshis': cost})
+        else:
+            priced.append((name, cost))
+
+    budget = client.get_balance(confirmations).get('balance', {}).get('satoshis', 0)
+    for name, cost in priced:
+        if cost > budget:
+            emit({'name': name, 'state': 'unfunded', 'satoshis': cost, 'budget': budget})
+            continue
+        if dry_run:
+            budget -= cost
+            emit({'name': name, 'state': 'would_submit', 'satoshis': cost})
+            continue
+        # backpressure: hand the registrar another name only once its queue has drained below --max_queue
+        depth = len(registrar_queue(client))
+        while depth >= max_queue:
+            click.echo("registrar queue holds {}, waiting {}s".format(depth, poll), err=True)
+            time.sleep(poll)
+            depth = len(registrar_queue(client))
+        emit(journal.record(name, 'submitting', satoshis=cost))
+        # anything short of a clear rejection may have been spent, so it counts against the budget
+        budget -= cost
+        try:
+            body = client.register_name(name)
+        except BlockstackAPIError as e:
+            if e.status_code < 500:
+                budget += cost
+            emit(journal.record(name, 'failed' if e.status_code < 500 else 'unknown', error=e.format_message()))
+            continue
+        except requests.RequestException as e:
+            emit(journal.record(name, 'unknown', error=str(e)))
+            continue
+        body = body if isinstance(body, dict) else {}
+        if body.get('error'):
+            budget += cost
+            emit(journal.record(name, 'failed', error=body['error']))
+        else:
+            emit(journal.record(name, 'submitted', satoshis=cost, transaction_hash=body.get('transaction_hash')))
+
+    while True:
+        queue = frozenset(registrar_queue(client))
+        # a name leaves the registrar queue once its register transaction is confirmed
+        settled = [name for name in names if outcome[name] == 'submitted' and name not in queue]
+        for name, r, error in fetch_map(config, client.get_name, settled, concurrency):
+            if error is None and r.ok:
+                address = decode_json(r).get('address')
+                emit(settle(name, 'confirmed' if address == owner else 'lost', address=address))
+            # the registrar may take a poll or two to list a name it was just handed, after that a
+            # name neither queued nor on chain was dropped, and whatever it spent is gone
+            elif error is None and r.status_code == 404 and time.time() - journal.last[name]['time'] >= SETTLE_GRACE_POLLS * poll:
+                emit(settle(name, 'lost', error='left the registrar queue without being registered'))
+        if not wait or not any(outcome[name] == 'submitted' for name in names):
+            break
+        time.sleep(poll)
+    write_totals(config, {'totals': dict(collections.Counter(state or 'pending' for state in outcome.values()))}, sort_keys=True)
+
+MIRROR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (
+    name TEXT PRIMARY KEY,
+    namespace TEXT,
+    address TEXT,
+    zonefile_hash TEXT,
+    status TEXT,
+    last_txid TEXT,
+    expire_block INTEGER,
+    record TEXT,
+    synced_at REAL
+);
+CREATE INDEX IF NOT EXISTS names_namespace ON names (namespace);
+CREATE INDEX IF NOT EXISTS names_address ON names (address);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def open_mirror(config, path, create=False):
+    import sqlite3
+    path = path or os.path.join(config.cache_dir, 'mirror.db')
+    if not create and not os.path.exists(path):
+        raise click.ClickException("no mirror at {}, run `blockstack-cli mirror sync` first".format(path))
+    if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        os.makedirs(os.path.dirname(os.path.abspath(path)))
+    db = sqlite3.connect(path)
+    db.executescript(MIRROR_SCHEMA)
+    return db
+
+def mirror_record(db, name, record, synced_at):
+    import json
+    record = dict(record, name=name)
+    db.execute("INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+        name, name.rsplit('.', 1)[-1], record.get('address'), record.get('zonefile_hash'), record.get('status'),
+        record.get('last_txid'), record.get('expire_block'), json.dumps(record), synced_at))
+
+NAME_COST_UNIT = 100 # satoshis
+PRICING_FIELDS = ('namespace_id', 'base', 'coeff', 'buckets', 'nonalpha_discount', 'no_vowel_discount')
+
+def name_price(name, namespace, multiplier=1.0):
+    """satoshi price of NAME (without its namespace id), mirrors price_name() in blockstack core"""
+    buckets = namespace['buckets']
+    exponent = buckets[min(len(name), len(buckets)) - 1]
+    discount = 1.0
+    if not any(c in 'aeiouy' for c in name.lower()):
+        discount = max(discount, namespace['no_vowel_discount'])
+    if any(c in '0123456789-_' for c in name):
+        discount = max(discount, namespace['nonalpha_discount'])
+    price = float(namespace['coeff'] * (namespace['base'] ** exponent)) / discount * NAME_COST_UNIT
+    return int(max(price, NAME_COST_UNIT) * multiplier)
+
+class PriceEngine(object):
+    """prices names locally, fetching each namespace's pricing parameters once and keeping them in ROOT"""
+
+    def __init__(self, client, root, multiplier=1.0, refresh=False):
+        self.client = client
+        self.root = root
+        self.multiplier = multiplier
+        self.refresh = refresh
+        self._namespaces = {}
+
+    def namespace(self, tld):
+        if tld not in self._namespaces:
+            # remember failures too, so an unknown namespace costs one request rather than one per name
+            try:
+                self._namespaces[tld] = self._load(tld)
+            except click.ClickException as e:
+                self._namespaces[tld] = e
+        if isinstance(self._namespaces[tld], Exception):
+            raise self._namespaces[tld]
+        return self._namespaces[tld]
+
+    def _load(self, tld):
+        import json
+        path = os.path.join(self.root, '{}.json'.format(tld))
+        # pricing is fixed when a namespace is revealed, so a cached copy never goes stale
+        if os.path.exists(path) and not self.refresh:
+            with open(path) as f:
+                return json.load(f)
+        record = self.client.get_namespace(tld)
+        missing = [k for k in PRICING_FIELDS if k not in record]
+        if missing:
+            raise click.ClickException("namespace {} has no pricing parameters ({} missing)".format(tld, ', '.join(missing)))
+        params = dict((k, record[k]) for k in PRICING_FIELDS)
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        with open(path, 'w') as f:
+            json.dump(params, f)
+        return params
+
+    def price(self, fqn):
+        if '.' not in fqn:
+            raise click.BadParameter("{} has no namespace id".format(fqn))
+        name, tld = fqn.rsplit('.', 1)
+        return name_price(name, self.namespace(tld), self.multiplier)
+
+def node_name_price(client, fqn):
+    price = client.get_name_price(fqn)
+    return int(price.get('name_price', price)['satoshis'])
+
+def verify_prices(config, sample):
+    """re-price SAMPLE (name, satoshis) pairs on the node and report every disagreement on STDERR"""
+    import json
+    config.ensure_pool(8)
+    check = lambda pair: (pair[0], pair[1], node_name_price(config.client, pair[0]))
+    mismatches = [(n, local, remote) for n, local, remote in bounded_map(check, sample, 8) if local != remote]
+    for n, local, remote in mismatches:
+        click.echo(json.dumps({'name': n, 'local': local, 'node': remote, 'ratio': float(remote) / local}), err=True)
+    click.echo("verified {} local prices against the node, {} mismatched".format(len(sample), len(mismatches)), err=True)
+    return not mismatches
+
+# names per page of /v1/names and /v1/namespaces/<id>/names
+NAMES_PAGE_SIZE = 100
+
+def filter_size(capacity, fp_rate):
+    """bits and hash count of a Bloom filter holding CAPACITY names with a FP_RATE false positive rate"""
+    import math
+    bits = max(8, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+    hashes = max(1, int(round(float(bits) / max(capacity, 1) * math.log(2))))
+    return bits, hashes
+
+class NameFilter(object):
+    """Bloom filter over the registered names of a namespace
+
+    A name it says is absent is certainly not registered, one it says is present
+    might be, which only the node can settle.
+    """
+
+    def __init__(self, bits, hashes, data=None, names=0):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray((bits + 7) // 8) if data is None else bytearray(data)
+        self.names = names
+
+    def _positions(self, name):
+        import hashlib
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        # double hashing, two 64 bit halves of one digest stand in for HASHES independent hashes
+        h1, h2 = struct.unpack('<QQ', hashlib.sha256(name).digest()[:16])
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, name):
+        for bit in self._positions(name):
+            self.data[bit >> 3] |= 1 << (bit & 7)
+        self.names += 1
+
+    def __contains__(self, name):
+        data = self.data
+        return not any(not data[bit >> 3] & (1 << (bit & 7)) for bit in self._positions(name))
+
+class AvailabilityFilters(object):
+    """a NameFilter per namespace, kept in ROOT next to the consensus hash it was built at
+
+    A filter is rebuilt from the namespace's name pages once the chain moves past that
+    consensus hash, or with REFRESH. Failures are remembered, so an unknown namespace
+    costs one request rather than one per candidate.
+    """
+
+    def __init__(self, config, root, workers, fp_rate, refresh=False):
+        self.config = config
+        self.root = root
+        self.workers = workers
+        self.fp_rate = fp_rate
+        self.refresh = refresh
+        self._consensus = None
+        self._filters = {}
+
+    @property
+    def consensus(self):
+        if self._consensus is None:
+            self._consensus = self.config.client.get_consensus().get('consensus_hash')
+        return self._consensus
+
+    def filter(self, tld):
+        if tld not in self._filters:
+            try:
+                self._filters[tld] = self._load(tld)
+            except click.ClickException as e:
+                self._filters[tld] = e
+        if isinstance(self._filters[tld], Exception):
+            raise self._filters[tld]
+        return self._filters[tld]
+
+    def _load(self, tld):
+        import json
+        path = os.path.join(self.root, '{}.bloom'.format(tld))
+        if os.path.exists(path) and not self.refresh:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                data = f.read()
+            if header.get('consensus_hash') == self.consensus and len(data) == (header['bits'] + 7) // 8:
+                return NameFilter(header['bits'], header['hashes'], data, header['names'])
+        return self._build(tld, path)
+
+    def _build(self, tld, path):
+        import json
+        import tempfile
+        consensus = self.consensus
+        fetch = functools.partial(self.config.client.get_namespace_names, tld)
+        last_page = find_last_page(fetch)
+        bloom = NameFilter(*filter_size((last_page + 1) * NAMES_PAGE_SIZE, self.fp_rate))
+        for entry in iter_pages(self.config, fetch, self.workers, last_page=last_page):
+            bloom.add(entry)
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        header = {'tld': tld, 'consensus_hash': consensus, 'names': bloom.names, 'bits': bloom.bits, 'hashes': bloom.hashes}
+        fd, tmp = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(header, sort_keys=True).encode('utf-8') + b'\n')
+            f.write(bytes(bloom.data))
+        os.rename(tmp, path)
+        click.echo("indexed {} names from .{} in {} KB".format(bloom.names, tld, len(bloom.data) // 1024), err=True)
+        return bloom
+
+def check_availability(config, filters, candidates, concurrency):
+    """stream whether each candidate is available, asking the node only about the ones the filters cannot rule out"""
+    totals = {'candidates': 0, 'available': 0, 'registered': 0, 'confirmed': 0, 'false_positives': 0, 'errors': 0}
+
+    def maybe_registered():
+        # runs on the calling thread as fetch_map pulls the next name, so these
+        # records are written straight away while the confirmations are in flight
+        for candidate in candidates:
+            totals['candidates'] += 1
+            try:
+                if '.' not in candidate:
+                    raise click.BadParameter("{} has no namespace id".format(candidate))
+                hit = candidate in filters.filter(candidate.rsplit('.', 1)[1])
+            except click.ClickException as e:
+                totals['errors'] += 1
+                write_record(config, {'name': candidate, 'error': e.format_message()})
+                continue
+            if hit:
+                yield candidate
+            else:
+                totals['available'] += 1
+                write_record(config, {'name': candidate, 'available': True})
+
+    for candidate, r, error in fetch_map(config, config.client.get_name, maybe_registered(), concurrency):
+        totals['confirmed'] += 1
+        record = lookup('name', candidate, r, error)
+        if r is not None and r.status_code == 404:
+            record = {'name': candidate, 'available': True, 'status_code': 404}
+            totals['available'] += 1
+            totals['false_positives'] += 1
+        elif 'result' in record:
+            record = {'name': candidate, 'available': False, 'status': record['result'].get('status')}
+            totals['registered'] += 1
+        else:
+            totals['errors'] += 1
+        write_record(config, record)
+    write_totals(config, {'totals': totals})
+
+# `wallet send` builds its transactions here and signs them with coincurve, so keys never go to the node
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+# version bytes of mainnet and testnet/regtest addresses and WIF keys
+P2PKH_VERSIONS = {0x00: 'mainnet', 0x6f: 'testnet'}
+P2SH_VERSIONS = {0x05: 'mainnet', 0xc4: 'testnet'}
+WIF_VERSIONS = {0x80: 'mainnet', 0xef: 'testnet'}
+
+def sha256d(data):
+    import hashlib
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+def b58check_encode(version, payload):
+    data = struct.pack('B', version) + payload
+    data += sha256d(data)[:4]
+    n = int(binascii.hexlify(data), 16)
+    chars = []
+    while n:
+        n, r = divmod(n, 58)
+        chars.append(BASE58_ALPHABET[r])
+    return '1' * (len(data) - len(data.lstrip(b'\0'))) + ''.join(reversed(chars))
+
+def b58check_decode(text):
+    """(version, payload) of a base58check string, ValueError if it is not one"""
+    n = 0
+    for c in text:
+        n = n * 58 + BASE58_ALPHABET.index(c)
+    digits = '{:x}'.format(n) if n else ''
+    data = b'\0' * (len(text) - len(text.lstrip('1'))) + binascii.unhexlify('0' * (len(digits) % 2) + digits)
+    if len(data) < 5 or sha256d(data[:-4])[:4] != data[-4:]:
+        raise ValueError("bad checksum")
+    return bytearray(data[:1])[0], data[1:-4]
+
+def decode_address(address):
+    """(network, output script) paying ADDRESS, a P2PKH or P2SH bitcoin address"""
+    try:
+        version, payload = b58check_decode(address)
+    except ValueError:
+        raise click.BadParameter("{} is not a base58check address".format(address))
+    if len(payload) == 20 and version in P2PKH_VERSIONS:
+        return P2PKH_VERSIONS[version], b'\x76\xa9\x14' + payload + b'\x88\xac'
+    if len(payload) == 20 and version in P2SH_VERSIONS:
+        return P2SH_VERSIONS[version], b'\xa9\x14' + payload + b'\x87'
+    raise click.BadParameter("{} is not a P2PKH or P2SH address".format(address))
+
+def parse_private_key(key):
+    """(secret, compressed, network) of a WIF key, or of hex with an optional 01 suffix (network None)"""
+    if re.match(r'^[0-9a-fA-F]{64}(01)?$', key):
+        return binascii.unhexlify(key[:64]), len(key) == 66, None
+    try:
+        version, payload = b58check_decode(key)
+    except ValueError:
+        raise click.BadParameter("the payment key is neither WIF nor hex")
+    if version not in WIF_VERSIONS or len(payload) not in (32, 33):
+        raise click.BadParameter("the payment key is neither WIF nor hex")
+    return payload[:32], len(payload) == 33, WIF_VERSIONS[version]
+
+def signing_key(secret):
+    """a coincurve (libsecp256k1) private key for the 32 byte SECRET"""
+    try:
+        import coincurve
+    except ImportError:
+        raise click.UsageError("wallet send signs with coincurve, pip install 'blockstack-cli[wallet]'")
+    try:
+        return coincurve.PrivateKey(secret)
+    except ValueError:
+        raise click.BadParameter("the payment key is out of range")
+
+SIGHASH_ALL = 1
+# bytes of a legacy transaction: version, counts and locktime, one P2PKH input by key type, one output by script
+TX_OVERHEAD_BYTES = 10
+P2PKH_INPUT_BYTES = {True: 148, False: 180}
+TX_OUTPUT_BYTES = 9
+# the network will not relay outputs below this, or transactions above MAX_STANDARD_TX_BYTES
+DUST_SATOSHIS = 546
+MAX_STANDARD_TX_BYTES = 100000
+BNB_MAX_TRIES = 100000
+
+def varint(n):
+    if n < 0xfd:
+        return struct.pack('<B', n)
+    if n <= 0xffff:
+        return b'\xfd' + struct.pack('<H', n)
+    if n <= 0xffffffff:
+        return b'\xfe' + struct.pack('<I', n)
+    return b'\xff' + struct.pack('<Q', n)
+
+def push_data(data):
+    return struct.pack('B', len(data)) + data
+
+def serialize_tx(inputs, outputs, scripts):
+    """a version 1 transaction spending INPUTS ((txid, index) pairs) with SCRIPTS into OUTPUTS ((satoshis, script) pairs)"""
+    parts = [struct.pack('<I', 1), varint(len(inputs))]
+    for (txid, index), script in zip(inputs, scripts):
+        parts.extend([binascii.unhexlify(txid)[::-1], struct.pack('<I', index), varint(len(script)), script, b'\xff\xff\xff\xff'])
+    parts.append(varint(len(outputs)))
+    for satoshis, script in outputs:
+        parts.extend([struct.pack('<q', satoshis), varint(len(script)), script])
+    parts.append(struct.pack('<I', 0))
+    return b''.join(parts)
+
+def sign_p2pkh(inputs, outputs, key, compressed, script):
+    """the raw transaction with every input, all paying SCRIPT, signed SIGHASH_ALL by KEY
+
+    libsecp256k1 signs with RFC 6979 nonces and low S values, as the network relays.
+    """
+    pubkey = key.public_key.format(compressed)
+    blank = [b''] * len(inputs)
+    signed = []
+    for i in range(len(inputs)):
+        preimage = serialize_tx(inputs, outputs, blank[:i] + [script] + blank[i + 1:]) + struct.pack('<I', SIGHASH_ALL)
+        signature = key.sign(sha256d(preimage), hasher=None)
+        signed.append(push_data(signature + struct.pack('B', SIGHASH_ALL)) + push_data(pubkey))
+    return serialize_tx(inputs, outputs, signed)
+
+def branch_and_bound(values, target, tolerance, max_tries=BNB_MAX_TRIES):
+    """indices into VALUES (sorted largest first) summing to between TARGET and TARGET + TOLERANCE
+    with the least excess, or None when no such set turns up in MAX_TRIES steps
+
+    A depth first search over include/exclude of each value, as in Bitcoin Core. Branches
+    are cut once they overshoot or can no longer reach TARGET with what is left, and an
+    exclusion is not retried for a value equal to the one just excluded.
+    """
+    available = sum(values)
+    if available < target:
+        return None
+    selection, total = [], 0
+    best, best_excess = None, None
+    for _ in range(max_tries):
+        backtrack = False
+        if total + available < target or total > target + tolerance:
+            backtrack = True
+        elif total >= target:
+            if best is None or total - target < best_excess:
+                best, best_excess = list(selection), total - target
+                if best_excess == 0:
+                    break
+            backtrack = True
+        if backtrack:
+            # back to the last value included, whose exclusion branch is still to be searched
+            while selection and not selection[-1]:
+                selection.pop()
+                available += values[len(selection)]
+            if not selection:
+                break
+            selection[-1] = False
+            total -= values[len(selection) - 1]
+        else:
+            value = values[len(selection)]
+            available -= value
+            if selection and not selection[-1] and value == values[len(selection) - 1]:
+                selection.append(False)
+            else:
+                selection.append(True)
+                total += value
+    if best is None:
+        return None
+    return [i for i, included in enumerate(best) if included]
+
+def utxo_outpoint(utxo):
+    outpoint = utxo.get('outpoint') or {}
+    return outpoint.get('hash', utxo.get('transaction_hash')), outpoint.get('index', utxo.get('output_index'))
+
+def select_coins(utxos, amount, fee_rate, input_bytes, base_bytes, change_bytes):
+    """(utxos to spend, change, fee, how they were picked) to pay AMOUNT at FEE_RATE satoshis per byte
+
+    Coins are weighed by their value less the fee to spend them. Branch and bound looks for
+    a set that needs no change output. Failing that, the smallest coin that covers the
+    payment on its own is used, or else the largest coins, which keeps the transaction small.
+    """
+    input_fee = fee_rate * input_bytes
+    coins = sorted((u for u in utxos if u['value'] > input_fee), key=lambda u: u['value'], reverse=True)
+    values = [u['value'] - input_fee for u in coins]
+    target = amount + fee_rate * base_bytes
+    # a change output, plus spending it again later, costs this much, so anything below it may as well be fee
+    cost_of_change = fee_rate * (change_bytes + input_bytes)
+    picked = branch_and_bound(values, target, cost_of_change)
+    how = 'branch_and_bound'
+    if picked is None:
+        covering = [i for i, value in enumerate(values) if value >= target]
+        if covering:
+            picked, how = [covering[-1]], 'single_coin'
+        else:
+            picked, total = [], 0
+            for i, value in enumerate(values):
+                if total >= target:
+                    break
+                picked.append(i)
+                total += value
+            how = 'largest_first'
+    selected = [coins[i] for i in picked]
+    excess = sum(values[i] for i in picked) - target
+    if excess < 0:
+        raise click.ClickException("insufficient funds: {} spendable satoshis across {} coins, {} needed plus fees".format(
+            sum(u['value'] for u in utxos), len(utxos), amount))
+    change = excess - fee_rate * change_bytes if how != 'branch_and_bound' else 0
+    if change < DUST_SATOSHIS:
+        change = 0
+    return selected, change, sum(u['value'] for u in selected) - amount - change, how
+
+LOCAL_HOST_RE = re.compile(r'^(localhost|127\.\d+\.\d+\.\d+|\[::1\])(:\d+)?$')
+
+def build_payment(config, key, amount, address, confirmations, fee_rate):
+    """a signed transaction paying AMOUNT satoshis to ADDRESS from the payment key, and what went into it"""
+    network, pay_script = decode_address(address)
+    if key is None:
+        raise click.UsageError("pass the payment key with --key (or BLOCKSTACK_CLI_PAYMENT_KEY), or --key node for the node wallet's")
+    if key == 'node':
+        # the node hands its wallet keys to anyone who asks, so never over the open network
+        if config.method != 'https://' and not LOCAL_HOST_RE.match(config.client.host):
+            raise click.UsageError("--key node would fetch the payment key from {} over plain http, use --ssl or a local node".format(config.client.host))
+        keys = config.client.get_wallet_keys()
+        key = keys.get('payment_privkey')
+        # a multisig wallet hands back its redeem script and keys instead
+        if not key or isinstance(key, dict):
+            raise click.ClickException("the node's payment key is not a single key, pass --key")
+    secret, compressed, key_network = parse_private_key(key)
+    if key_network is not None and key_network != network:
+        raise click.BadParameter("{} is a {} address but the payment key is for {}".format(address, network, key_network))
+    signer = signing_key(secret)
+    pubkey_hash = hash160(signer.public_key.format(compressed))
+    source = b58check_encode(0x00 if network == 'mainnet' else 0x6f, pubkey_hash)
+    change_script = b'\x76\xa9\x14' + pubkey_hash + b'\x88\xac'
+    utxos = [u for u in config.client.get_utxo(source) if u.get('confirmations', 0) >= confirmations]
+    input_bytes = P2PKH_INPUT_BYTES[compressed]
+    selected, change, fee, how = select_coins(utxos, amount, fee_rate, input_bytes,
+                                              TX_OVERHEAD_BYTES + TX_OUTPUT_BYTES + len(pay_script), TX_OUTPUT_BYTES + len(change_script))
+    size = TX_OVERHEAD_BYTES + input_bytes * len(selected) + TX_OUTPUT_BYTES + len(pay_script) + (TX_OUTPUT_BYTES + len(change_script) if change else 0)
+    if size > MAX_STANDARD_TX_BYTES:
+        raise click.ClickException("paying {} takes {} coins, over the relay size limit, consolidate the wallet first".format(amount, len(selected)))
+    outputs = [(amount, pay_script)] + ([(change, change_script)] if change else [])
+    tx = sign_p2pkh([utxo_outpoint(u) for u in selected], outputs, signer, compressed, change_script)
+    return {'tx': binascii.hexlify(tx).decode('ascii'), 'txid': binascii.hexlify(sha256d(tx)[::-1]).decode('ascii'),
+            'from': source, 'to': address, 'amount': amount, 'fee': fee, 'change': change, 'bytes': len(tx),
+            'inputs': len(selected), 'selection': how}
+
+def json_diff(old, new, path=''):
+    """yield add/remove/change events for every difference between two decoded JSON documents"""
+    # frozenset, since `set` is the `config set` command in this module
+    import json
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(frozenset(old) | frozenset(new)):
+            child = '{}/{}'.format(path, key)
+            if key not in new:
+                yield {'op': 'remove', 'path': child, 'old': old[key]}
+            elif key not in old:
+                yield {'op': 'add', 'path': child, 'new': new[key]}
+            else:
+                for event in json_diff(old[key], new[key], child):
+                    yield event
+    elif isinstance(old, list) and isinstance(new, list):
+        # queues and pending lists shift as entries come and go, so compare them as sets rather than by index
+        key = lambda entry: json.dumps(entry, sort_keys=True)
+        old_keys, new_keys = frozenset(key(e) for e in old), frozenset(key(e) for e in new)
+        for entry in old:
+            if key(entry) not in new_keys:
+                yield {'op': 'remove', 'path': path, 'old': entry}
+        for entry in new:
+            if key(entry) not in old_keys:
+                yield {'op': 'add', 'path': path, 'new': entry}
+    elif old != new:
+        yield {'op': 'change', 'path': path, 'old': old, 'new': new}
+
+def watch(config, fetch, interval):
+    """poll fetch(headers=...) every INTERVAL seconds over the shared session, printing only what changed as NDJSON"""
+    import hashlib
+    import time
+    import requests
+    etag, digest, state = None, None, None
+    # a poll has to reach the node, or nothing would change until the next block
+    config.client.cache = None
+    while True:
+        started = time.time()
+        events = []
+        try:
+            r = fetch(headers={'If-None-Match': etag} if etag else {})
+        except requests.RequestException as e:
+            events = [{'op': 'error', 'error': str(e)}]
+        else:
+            etag = r.headers.get('ETag')
+            # nodes that send no ETag still never cost more than a hash when nothing moved
+            body_digest = hashlib.sha1(r.content).hexdigest()
+            if r.status_code != 304 and body_digest != digest:
+                digest = body_digest
+                if not r.ok:
+                    events = [{'op': 'error', 'status_code': r.status_code, 'error': r.text}]
+                elif state is None:
+                    state = r.json()
+                    events = [{'op': 'snapshot', 'new': state}]
+                else:
+                    new = r.json()
+                    events = list(json_diff(state, new))
+                    state = new
+        for event in events:
+            event['time'] = int(started)
+            write_record(config, event)
+        time.sleep(max(0, interval - (time.time() - started)))
+
+# Default Configuration
+def make_default_config():
+    # built on demand: it reads HOME and draws a fresh api_password
+    import base64
+    return {
+      'subdomain-resolution': {
+        'subdomains_db': '{}.blockstack/subdomains.db'.format(os.environ["HOME"]),
+      },
+      'blockstack-client': {
+        'api_endpoint_host': 'localhost',
+        'blockchain_writer': 'blockstack_utxo',
+        'api_endpoint_port': '6270',
+        'api_password': base64.b64encode(os.urandom(32)).decode('ascii').rstrip('='),
+        'poll_interval': '300',
+        'server': 'node.blockstack.org',
+        'email': '',
+        'metadata': 'metadata',
+        'storage_drivers_required_write': 'disk,dropbox',
+        'queue_path': '{}.blockstack/queues.db'.format(os.environ["HOME"]),
+        'storage_drivers': 'disk,dropbox,s3,blockstack_resolver,blockstack_server,http,dht',
+        'blockchain_reader': 'blockstack_utxo',
+        'client_version': '0.14.4.2',
+        'api_endpoint_bind': 'localhost',
+        'port': 6264,
+        'anonymous_statistics': True,
+      },
+      'bitcoind': {
+        'passwd': 'blockstacksystem',
+        'regtest': 'False',
+        'spv_path': '{}.virtualchain-spv-headers.dat'.format(os.environ["HOME"]),
+        'server': 'bitcoin.blockstack.com',
+        'p2p_port': '8333',
+        'user': 'blockstack',
+        'timeout': '300',
+        'port': '8332',
+      },
+      'blockstack': {
+        'server': 'node.blockstack.org',
+      },
+      'blockchain-writer': {
+        'url': 'https://utxo.blockstack.org',
+        'utxo_provider': 'blockstack_utxo',
+      },
+      'blockchain-reader': {
+        'url': 'https://utxo.blockstack.org',
+        'utxo_provider': 'blockstack_utxo',
+      },
+    }
+
+def make_docker_config():
+    # the default config, listening on every interface of the container
+    dc = make_default_config()
+    dc['blockstack-client']['api_endpoint_bind'] = '0.0.0.0'
+    dc['blockstack-client']['api_endpoint_host'] = '0.0.0.0'
+    return dc
+
+CONFIG_TEMPLATES = {'default': make_default_config, 'docker': make_docker_config}
+
+def config_text(value):
+    # the node keeps every value as a string, and python spells booleans True where toml says true
+    value = u'{}'.format(value)
+    return value.lower() if value.lower() in ('true', 'false') else value
+
+def check_config_shape(desired, source):
+    """raise a UsageError unless DESIRED is sections of plain values, the only shape the node's config takes"""
+    for section, values in sorted(desired.items()):
+        if not isinstance(values, dict):
+            raise click.UsageError("{}: {} is not a section, every key belongs under a [section]".format(source, section))
+        for key, value in sorted(values.items()):
+            if isinstance(value, (dict, list)):
+                raise click.UsageError("{}: {}.{} is a table or array, the node only keeps plain values".format(source, section, key))
+
+# template keys a node keeps once it has them: the api_password is drawn fresh on every
+# call and the paths are built from this machine's HOME, not the node's
+TEMPLATE_KEPT_KEYS = frozenset([
+    ('blockstack-client', 'api_password'),
+    ('blockstack-client', 'queue_path'),
+    ('subdomain-resolution', 'subdomains_db'),
+    ('bitcoind', 'spv_path'),
+])
+
+def config_plan(current, desired, defaults, prune):
+    """the set, delete and delete_section calls that take the node from CURRENT to DESIRED
+
+    DEFAULTS (from a template) are desired values too, below DESIRED itself, except the
+    TEMPLATE_KEPT_KEYS, which only fill in a key the node does not have yet. With PRUNE,
+    keys and sections in neither DESIRED nor DEFAULTS are deleted.
+    """
+    for section in sorted(frozenset(current) | frozenset(desired) | frozenset(defaults)):
+        have, want, fill = current.get(section, {}), desired.get(section, {}), defaults.get(section, {})
+        for key in sorted(frozenset(want) | frozenset(fill)):
+            value = want[key] if key in want else fill[key]
+            kept = key not in want and (section, key) in TEMPLATE_KEPT_KEYS
+            if key not in have or (not kept and config_text(have[key]) != config_text(value)):
+                change = {'op': 'set', 'section': section, 'key': key, 'new': value}
+                if key in have:
+                    change['old'] = have[key]
+                yield change
+        if not prune:
+            continue
+        if section not in desired and section not in defaults:
+            yield {'op': 'delete_section', 'section': section}
+            continue
+        for key in sorted(frozenset(have) - frozenset(want) - frozenset(fill)):
+            yield {'op': 'delete', 'section': section, 'key': key, 'old': have[key]}
+
+def apply_config_change(client, change):
+    """send one config_plan change, as an NDJSON-ready record that never raises"""
+    import requests
+    record = dict(change)
+    try:
+        if change['op'] == 'set':
+            r = client.set_node_config(change['section'], change['key'], config_text(change['new']), raw=True)
+        elif change['op'] == 'delete':
+            r = client.delete_node_config(change['section'], change['key'], raw=True)
+        else:
+            r = client.delete_node_config_section(change['section'], raw=True)
+    except requests.RequestException as e:
+        record.update(status='error', error=str(e))
+        return record
+    if r.ok:
+        record['status'] = 'applied'
+    else:
+        record.update(status='error', error=str(BlockstackAPIError(r).message))
+    return record
+
+class FrameWriter(io.RawIOBase):
+    """a write-only stream that sends what is written to a forwarding client as CHANNEL frames"""
+
+    def __init__(self, sock, channel):
+        self.sock = sock
+        self.channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        import cli_client
+        cli_client.send_frame(self.sock, self.channel, bytes(data))
+        return len(data)
+
+class FrameReader(io.RawIOBase):
+    """a read-only stream over the STDIN frames of a forwarding client"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.pending = b''
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        import cli_client
+        while not self.pending and not self.eof:
+            channel, data = cli_client.read_frame(self.sock)
+            self.eof = channel != b'0' or not data
+            self.pending = data or b''
+        size = min(len(buf), len(self.pending))
+        buf[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+def run_forwarded(sock, request):
+    """run one forwarded argv as if it were started in the client's shell, returning its exit code"""
+    import traceback
+    stdin = io.TextIOWrapper(io.BufferedReader(FrameReader(sock)), encoding='utf-8')
+    stdout = io.TextIOWrapper(io.BufferedWriter(FrameWriter(sock, b'1')), encoding='utf-8', line_buffering=True)
+    stderr = io.TextIOWrapper(io.BufferedWriter(FrameWriter(sock, b'2')), encoding='utf-8', line_buffering=True)
+    saved = sys.stdin, sys.stdout, sys.stderr, os.getcwd(), dict(os.environ)
+    # the client's BLOCKSTACK_CLI_* variables stand in for the daemon's own
+    for key in [k for k in os.environ if k.startswith('BLOCKSTACK_CLI_')]:
+        del os.environ[key]
+    os.environ.update(request['env'])
+    sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+    try:
+        os.chdir(request['cwd'])
+        cli.main(args=request['argv'], prog_name='blockstack-cli')
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        if e.code is not None and not isinstance(e.code, int):
+            stderr.write(u'{}\n'.format(e.code))
+    except Exception:
+        stderr.write(traceback.format_exc())
+        code = 1
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = saved[:3]
+        os.chdir(saved[3])
+        os.environ.clear()
+        os.environ.update(saved[4])
+    stdout.flush()
+    stderr.flush()
+    return code
+
+def interrupt_on_hangup(sock, thread_id, done):
+    """raise KeyboardInterrupt in the thread running a forwarded command once its client hangs up, as ^C would"""
+    import ctypes
+    import select
+    poller = select.poll()
+    poller.register(sock, select.POLLHUP)
+    while not done.is_set():
+        # POLLHUP only, the client's STDIN frames are the command's to read
+        if any(events & (select.POLLHUP | select.POLLERR) for _, events in poller.poll(500)):
+            if not done.is_set():
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(KeyboardInterrupt))
+            return
+
+def serve_command(sock, lock):
+    """answer one client of `serve`, running its command unless another one is still running"""
+    import json
+    import socket
+    import threading
+    import cli_client
+    acquired = False
+    try:
+        channel, data = cli_client.read_frame(sock)
+        if channel != b'a':
+            return
+        # stdio, cwd and environment are per process, so commands take turns and a
+        # client that finds the daemon busy runs its command itself
+        acquired = lock.acquire(False)
+        if not acquired:
+            cli_client.send_frame(sock, b'b', b'')
+            return
+        cli_client.send_frame(sock, b'r', b'')
+        done = threading.Event()
+        monitor = threading.Thread(target=interrupt_on_hangup, args=(sock, threading.current_thread().ident, done))
+        monitor.start()
+        try:
+            code = run_forwarded(sock, json.loads(data.decode('utf-8')))
+            cli_client.send_frame(sock, b'x', str(code).encode('ascii'))
+        finally:
+            # an interrupt the monitor raised late lands in here, never past the release below
+            done.set()
+            monitor.join()
+    except (IOError, OSError, socket.error, KeyboardInterrupt):
+        # the client hung up, say a pipe into `head` closing early
+        pass
+    finally:
+        if acquired:
+            lock.release()
+        sock.close()
 
 ###########################
 # GROUP: blockstack-cli
 # blockstack-cli
 ###########################
 @click.group()
-@click.option('--host', default='localhost:6270', help='blockstack api node to connect to ', envvar="BLOCKSTACK_CLI_HOST")
+@click.option('--host', default='localhost:6270', help='blockstack api node to connect to, or several separated by commas', envvar="BLOCKSTACK_CLI_HOST")
 @click.option('--ssl', is_flag=True)
 @click.option('--debug', is_flag=True)
 @click.option('--password', default='foobarbaz', help='api password for instance to connect', envvar="BLOCKSTACK_CLI_PASSWORD")
-@click.option('--fmt', default='json', help='format to output responses {json|toml|yaml}')
+@click.option('--fmt', default='json', type=click.Choice(sorted(list(FORMATTERS) + RECORD_FORMATS)), help='format to output responses {csv|json|ndjson|table|toml|yaml}')
+@click.option('--fields', default=None, help='comma separated fields to keep of every record, dots for nested ones (address,zonefile_hash)')
+@click.option('--where', multiple=True, help='keep only records where FIELD OP VALUE holds, OP one of == != > >= < <= ~ (regex), repeat to require several')
+@click.option('--pool_size', default=10, help='max keep-alive connections held open to the api node', envvar="BLOCKSTACK_CLI_POOL_SIZE")
+@click.option('--cache_dir', default=os.path.join(os.path.expanduser('~'), '.blockstack-cli'), help='directory for local caches', envvar="BLOCKSTACK_CLI_CACHE_DIR")
+@click.option('--zonefile_cache_mb', default=64, help='size cap of the local zonefile cache in MB', envvar="BLOCKSTACK_CLI_ZONEFILE_CACHE_MB")
+@click.option('--hedge', type=float, default=None, help='with several hosts, repeat a read on the next fastest node once it runs past this latency percentile (e.g. 95)', envvar="BLOCKSTACK_CLI_HEDGE")
+@click.option('--trace', type=click.Choice(['summary', 'jsonl', 'prom']), default=None, help='time dns, connect, tls, ttfb, download, decode and format of every request, reported on exit', envvar="BLOCKSTACK_CLI_TRACE")
+@click.option('--trace_file', type=click.Path(dir_okay=False, writable=True), default=None, help='write the --trace report here instead of STDERR', envvar="BLOCKSTACK_CLI_TRACE_FILE")
+@click.option('--transport', type=click.Choice(['threads', 'asyncio']), default='threads', help='how bulk commands fan out: a thread per request, or asyncio coroutines on one event loop (python 3 and aiohttp)', envvar="BLOCKSTACK_CLI_TRANSPORT")
+@click.option('--cache', is_flag=True, help='answer name, history, address and names page reads from a local cache while the consensus hash stays the same', envvar="BLOCKSTACK_CLI_CACHE")
+@click.option('--adaptive', is_flag=True, help='find how many requests each node takes at once, backing off on slow answers, errors and 429s; --workers becomes the ceiling', envvar="BLOCKSTACK_CLI_ADAPTIVE")
+@click.option('--rate', type=float, default=None, help='at most this many requests per second to each node', envvar="BLOCKSTACK_CLI_RATE")
 @pass_config
-def cli(config, host, password, ssl, debug, fmt):
+def cli(config, host, password, ssl, debug, fmt, fields, where, pool_size, cache_dir, zonefile_cache_mb, hedge, trace, trace_file, transport, cache, adaptive, rate):
     """A command line interface for the blockstack network and local installations"""
     config.host = host
     config.debug = debug
     config.password = password
     config.fmt = fmt
+    config.pool_size = pool_size
+    config.hedge = hedge
+    config.cache_dir = cache_dir
+    config.zonefile_cache_mb = zonefile_cache_mb
+    if transport == 'asyncio' and sys.version_info < (3, 6):
+        raise click.UsageError("--transport asyncio needs python 3.6 or later")
+    config.transport = transport
+    config.cache = cache
+    if rate is not None and rate <= 0:
+        raise click.BadParameter("must be more than 0", param_hint='--rate')
+    config.adaptive = adaptive
+    config.rate = rate
+    if adaptive and debug:
+        click.get_current_context().call_on_close(config.report_admission)
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    if fields or where or fmt in RECORD_FORMATS:
+        config.records = RecordWriter(fmt, fields, [parse_where(expr) for expr in where])
+        # a table holds its first rows back to size the columns
+        click.get_current_context().call_on_close(config.records.close)
+    if trace:
+        config.tracer = Tracer()
+        # the root context closes last, so one report covers every request, even every line of `batch`
+        click.get_current_context().call_on_close(lambda: config.tracer.report(trace, trace_file))
     if ssl:
         config.method = "https://"
     else:
         config.method = "http://"
 
+# blockstack-cli batch
+@cli.command()
+@click.argument('COMMANDS', type=click.File('r'), default='-')
+@click.option('--fail_fast', is_flag=True, help='stop at the first command that fails')
+@click.pass_context
+def batch(ctx, commands, fail_fast):
+    """run one command per line of COMMANDS (default STDIN) over one connection pool"""
+    import shlex
+    import requests
+    failed = 0
+    for lineno, line in enumerate(commands, 1):
+        args = shlex.split(line, comments=True)
+        if not args:
+            continue
+        try:
+            if args[0] == 'batch':
+                raise click.UsageError("batch can not be nested")
+            cmd_name, cmd, args = cli.resolve_command(ctx.parent, args)
+            with cmd.make_context(cmd_name, args, parent=ctx.parent) as sub_ctx:
+                cmd.invoke(sub_ctx)
+        except click.exceptions.Exit:
+            continue
+        except (click.ClickException, requests.RequestException) as e:
+            failed += 1
+            click.echo("line {}: {}".format(lineno, e.format_message() if isinstance(e, click.ClickException) else e), err=True)
+            if fail_fast:
+                break
+    if failed:
+        ctx.exit(1)
+
+# blockstack-cli serve
+@cli.command()
+@click.option('--socket', 'path', type=click.Path(dir_okay=False), default=None, help='unix socket to listen on, CACHE_DIR/serve.sock by default', envvar="BLOCKSTACK_CLI_SOCKET")
+@pass_config
+def serve(config, path):
+    """keep a warm process that later blockstack-cli runs hand their commands to"""
+    global WARM_CLIENTS
+    import signal
+    import socket
+    import threading
+    if sys.version_info < (3,):
+        raise click.UsageError("serve needs python 3")
+    if WARM_CLIENTS is not None:
+        raise click.UsageError("already serving")
+    # what the commands would otherwise import on every run
+    import importlib
+    for module in ('json', 'requests', 'sqlite3', 'toml', 'yaml'):
+        importlib.import_module(module)
+    path = path or os.path.join(config.cache_dir, 'serve.sock')
+    if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        os.makedirs(os.path.dirname(os.path.abspath(path)))
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            # left behind by a daemon that died
+            os.remove(path)
+        else:
+            raise click.ClickException("another serve is already listening on {}".format(path))
+        finally:
+            probe.close()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # commands run with this user's wallet and files, so nobody else may connect
+    umask = os.umask(0o077)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+    listener.listen(64)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    WARM_CLIENTS = {}
+    lock = threading.Lock()
+    click.echo("serving on {}".format(path), err=True)
+    try:
+        while True:
+            conn, _ = listener.accept()
+            worker = threading.Thread(target=serve_command, args=(conn, lock))
+            worker.daemon = True
+            worker.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        WARM_CLIENTS = None
+        listener.close()
+        os.remove(path)
+
 ###########################
 # GROUP: NODE
 # blockstack-cli node
@@ -134,20 +2627,19 @@ def node(config):
 @pass_config
 def ping(config):
     """check availibiltiy for connected node"""
-    url = create_url(config,"/v1/node/ping")
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    output(config, config.client.ping(raw=True))
 
 # blockstack-cli node registrar
 # https://blockstack.github.io/blockstack-core/#core-node-administration-get-registrar-state
 @node.command()
+@click.option('--watch', 'interval', type=float, default=None, help='poll every INTERVAL seconds and print only changes, as NDJSON')
 @pass_config
-def registrar(config):
+def registrar(config, interval):
     """check registrar state"""
-    path = "/v1/node/registrar/state"
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    if interval:
+        return watch(config, lambda **kw: config.client.get_registrar_state(raw=True, **kw), interval)
+    r = config.client.get_registrar_state(raw=True)
+    output(config, r)
     
 ###########################
 # GROUP: CONFIG
@@ -165,10 +2657,8 @@ def config(config):
 @pass_config
 def get(config):
     """print TOML config for current node"""
-    path = "/v1/node/config"
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_node_config(raw=True)
+    output(config, r)
 
 # blockstack-cli config default
 # https://blockstack.github.io/blockstack-core/#core-node-administration-get-the-node-s-config
@@ -176,7 +2666,7 @@ def get(config):
 @pass_config
 def default(config):
     """print default TOML config to STDOUT"""
-    click.echo(toml.dumps(default_config))
+    click.echo(toml_out(make_default_config()))
 
 # blockstack-cli config docker
 # https://blockstack.github.io/blockstack-core/#core-node-administration-get-the-node-s-config
@@ -184,10 +2674,40 @@ def default(config):
 @pass_config
 def docker(config):
     """print default TOML config to STDOUT"""
-    dc = default_config
-    dc['blockstack-client']['api_endpoint_bind'] = '0.0.0.0'
-    dc['blockstack-client']['api_endpoint_host'] = '0.0.0.0'
-    click.echo(toml.dumps(dc))
+    click.echo(toml_out(make_docker_config()))
+
+# blockstack-cli config apply
+# https://blockstack.github.io/blockstack-core/#core-node-administration-set-config-field
+@config.command()
+@click.argument('DESIRED', type=click.File('r'))
+@click.option('--template', type=click.Choice(sorted(CONFIG_TEMPLATES)), default=None, help='also apply the default or docker config, under DESIRED, keeping the node\'s api_password and paths')
+@click.option('--prune', is_flag=True, help='also delete keys and sections that are not in DESIRED or the template')
+@click.option('--concurrency', default=8, help='changes sent at once')
+@click.option('--dry_run', is_flag=True, help='print the changes without sending them')
+@pass_config
+def apply(config, desired, template, prune, concurrency, dry_run):
+    """change the node's config to match the DESIRED TOML file, sending only what differs"""
+    import toml
+    try:
+        wanted = toml.load(desired)
+    except toml.TomlDecodeError as e:
+        raise click.UsageError("{} is not valid TOML: {}".format(desired.name, e))
+    check_config_shape(wanted, desired.name)
+    current = config.client.get_node_config()
+    defaults = CONFIG_TEMPLATES[template]() if template else {}
+    plan = list(config_plan(current, wanted, defaults, prune))
+    totals = collections.Counter()
+    if dry_run:
+        records = (dict(change, status='planned') for change in plan)
+    else:
+        config.ensure_pool(concurrency)
+        records = bounded_map(functools.partial(apply_config_change, config.client), plan, concurrency)
+    for record in records:
+        totals[record['status']] += 1
+        write_record(config, record)
+    write_totals(config, {'totals': dict(totals, changes=len(plan))})
+    if totals['error']:
+        sys.exit(1)
 
 # blockstack-cli config set
 # https://blockstack.github.io/blockstack-core/#core-node-administration-set-config-field
@@ -198,10 +2718,8 @@ def docker(config):
 @pass_config
 def set(config, section, key, value):
     """reset configuration KEY in SECTION to VALUE for configured node"""
-    path = "/v1/node/config/{}?{}={}".format(section,key,value)
-    url = create_url(config,path)
-    r = requests.post(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.set_node_config(section, key, value, raw=True)
+    output(config, r)
 
 # blockstack-cli config delete
 # https://blockstack.github.io/blockstack-core/#core-node-administration-delete-a-config-field
@@ -211,10 +2729,8 @@ def set(config, section, key, value):
 @pass_config
 def delete(config, section, key):
     """remove configuration KEY in SECTION for configured node"""
-    path = "/v1/node/config/{}/{}".format(section,key)
-    url = create_url(config,path)
-    r = requests.delete(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.delete_node_config(section, key, raw=True)
+    output(config, r)
 
 # blockstack-cli config delete_section
 # https://blockstack.github.io/blockstack-core/#core-node-administration-delete-a-config-section
@@ -223,10 +2739,8 @@ def delete(config, section, key):
 @pass_config
 def delete_section(config, section):
     """remove configuration SECTION for configured node"""
-    path = "/v1/node/config/{}".format(section)
-    url = create_url(config,path)
-    r = requests.delete(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.delete_node_config_section(section, raw=True)
+    output(config, r)
     
 ###########################
 # GROUP: WALLET
@@ -244,10 +2758,8 @@ def wallet(config):
 @pass_config
 def payment_address(config):
     """retrieve the payment_address for your blockstack wallet"""
-    path = "/v1/wallet/payment_address"
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_payment_address(raw=True)
+    output(config, r)
 
 # blockstack-cli wallet owner_address
 # https://blockstack.github.io/blockstack-core/#core-wallet-management-get-wallet-owner-address
@@ -255,10 +2767,8 @@ def payment_address(config):
 @pass_config
 def owner_address(config):
     """retrieve the owner_address for your blockstack wallet"""
-    path = "/v1/wallet/owner_address"
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_owner_address(raw=True)
+    output(config, r)
     
 # blockstack-cli wallet pub_key
 # https://blockstack.github.io/blockstack-core/#core-wallet-management-get-wallet-data-public-key
@@ -266,10 +2776,8 @@ def owner_address(config):
 @pass_config
 def pub_key(config):
     """retrieve the pub_key for your blockstack wallet"""
-    path = "/v1/wallet/data_pubkey"
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_data_pubkey(raw=True)
+    output(config, r)
     
 # NOT IMPLEMENTED
 # blockstack-cli wallet set_key
@@ -291,27 +2799,31 @@ def set_key(config, key):
 @pass_config
 def balance(config, confirmations):
     """retrieve wallet balance"""
-    path = "/v1/wallet/balance/{}".format(confirmations)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_balance(confirmations, raw=True)
+    output(config, r)
 
-# NOT IMPLEMENTED
 # blockstack-cli wallet send
 # https://blockstack.github.io/blockstack-core/#core-wallet-management-withdraw-payment-wallet-funds
 @wallet.command()
-@click.option('--confirmations', default=6, help='number of confirmations to include transactions in wallet balance')
-@click.option('--tx_only', is_flag=True, help='a flag?')
-@click.argument('AMOUNT')
+@click.option('--confirmations', default=6, help='only spend outputs with at least this many confirmations')
+@click.option('--tx_only', is_flag=True, help='print the signed transaction instead of broadcasting it')
+@click.option('--fee_rate', default=10, help='fee in satoshis per byte', envvar="BLOCKSTACK_CLI_FEE_RATE")
+@click.option('--key', help="payment private key (WIF or hex) to spend from, or node to fetch the node wallet's (https or a local node only)", envvar="BLOCKSTACK_CLI_PAYMENT_KEY")
+@click.argument('AMOUNT', type=int)
 @click.argument('ADDRESS')
 @pass_config
-def send(config,amount,address,confirmations,tx_only):
-    """send AMOUNT to ADDRESS..."""
-    click.echo("NOT IMPLEMENTED, TEST ON REGTEST")
-    click.echo("args passed:")
-    click.echo("  AMOUNT -> {}".format(amount))
-    click.echo("  ADDRESS -> {}".format(address))
-    click.echo("  Confs -> {}".format(confirmations))
+def send(config,amount,address,confirmations,tx_only,fee_rate,key):
+    """send AMOUNT satoshis to ADDRESS"""
+    if amount < DUST_SATOSHIS:
+        raise click.BadParameter("must be at least {} satoshis".format(DUST_SATOSHIS), param_hint='AMOUNT')
+    if fee_rate < 1:
+        raise click.BadParameter("must be at least 1", param_hint='--fee_rate')
+    payment = build_payment(config, key, amount, address, confirmations, fee_rate)
+    if tx_only:
+        return output_data(config, payment)
+    result = config.client.broadcast_transaction(payment['tx'])
+    payment.pop('tx')
+    output_data(config, dict(payment, **(result if isinstance(result, dict) else {'result': result})))
 
 ###########################
 # GROUP: NAME
@@ -326,15 +2838,32 @@ def name(config):
 # blockstack-cli name register
 # https://blockstack.github.io/blockstack-core/#managing-names-register-a-name
 @name.command()
-@click.argument('NAME')
+@click.argument('NAME', required=False)
+@click.option('--from_file', type=click.File('r'), help='register every name listed in this file (- for STDIN), one per line, reporting progress as NDJSON')
+@click.option('--journal', type=click.Path(dir_okay=False), default=None, help='progress journal a rerun resumes from, defaults to FROM_FILE.journal')
+@click.option('--max_price', type=int, default=None, help='skip names costing more than this many satoshis')
+@click.option('--max_queue', default=5, help='only submit while the registrar queue holds fewer operations than this')
+@click.option('--poll', default=60.0, help='seconds between looks at the registrar queue while waiting')
+@click.option('--confirmations', default=6, help='confirmations the wallet balance counts when budgeting')
+@click.option('--concurrency', default=16, help='availability and price checks in flight at once')
+@click.option('--wait', is_flag=True, help='keep polling until every submitted name is confirmed')
+@click.option('--dry_run', is_flag=True, help='check availability, prices and balance without submitting anything')
 @pass_config
-def register(config, name):
+def register(config, name, from_file, journal, max_price, max_queue, poll, confirmations, concurrency, wait, dry_run):
     """register a NAME, requires funds in wallet"""
-    path = "/v1/names"
-    payload = {'name': name}
-    url = create_url(config,path)
-    r = requests.post(url, headers=make_headers(config), json=payload)
-    output(config, url, r)
+    if from_file:
+        if journal is None and not os.path.isfile(from_file.name):
+            raise click.UsageError("--journal is required when names come on STDIN")
+        journal = Journal(journal or from_file.name + '.journal')
+        try:
+            names = list(collections.OrderedDict.fromkeys(read_lines(from_file)))
+            return register_names(config, names, journal, max_price, max_queue, poll, confirmations, concurrency, wait, dry_run)
+        finally:
+            journal.close()
+    if name is None:
+        raise click.UsageError("NAME is required unless --from_file is given")
+    r = config.client.register_name(name, raw=True)
+    output(config, r)
 
 # blockstack-cli name revoke
 # https://blockstack.github.io/blockstack-core/#managing-names-revoke-name
@@ -343,10 +2872,8 @@ def register(config, name):
 @pass_config    
 def revoke(config, name):
     """revoke an owned NAME"""
-    path = "/v1/names/{}".format(name)
-    url = create_url(config,path)
-    r = requests.delete(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.revoke_name(name, raw=True)
+    output(config, r)
 
 # blockstack-cli name transfer
 # https://blockstack.github.io/blockstack-core/#managing-names-transfer-name
@@ -356,25 +2883,30 @@ def revoke(config, name):
 @pass_config    
 def transfer(config, name, owner):
     """transfer an owned NAME to OWNER"""
-    path = "/v1/names/{}/owner".format(name)
-    payload = {'owner': owner}
-    url = create_url(config,path)
-    r = requests.put(url, headers=make_headers(config), json=payload)
-    output(config, url, r)
+    r = config.client.transfer_name(name, owner, raw=True)
+    output(config, r)
 
 # blockstack-cli name set_zonefile
 # https://blockstack.github.io/blockstack-core/#managing-names-set-zone-file
 @name.command()
-@click.argument('NAME')
-@click.argument('ZONEFILE', type=click.File('rb'))
+@click.argument('NAME', required=False)
+@click.argument('ZONEFILE', type=click.File('rb'), required=False)
+@click.option('--from_dir', type=click.Path(exists=True, file_okay=False), help='publish every file in this directory, each named after its name (NAME or NAME.zonefile), as NDJSON')
+@click.option('--manifest', type=click.File('r'), help='publish every NAME PATH pair listed in this file (- for STDIN), one per line, as NDJSON')
+@click.option('--concurrency', default=8, help='names checked and uploaded at once with --from_dir or --manifest')
+@click.option('--dry_run', is_flag=True, help='with --from_dir or --manifest, report what would be updated without sending anything')
 @pass_config    
-def set_zonefile(config, name, zonefile):
+def set_zonefile(config, name, zonefile, from_dir, manifest, concurrency, dry_run):
     """set zonefile for NAME"""
-    path = "/v1/names/{}/zonefile".format(name)
-    payload = { 'zonefile': zonefile.read() }
-    url = create_url(config,path)
-    r = requests.put(url, headers=make_headers(config), json=payload)
-    output(config, url, r)
+    if from_dir or manifest:
+        if name or zonefile:
+            raise click.UsageError("give NAME ZONEFILE, or --from_dir/--manifest, not both")
+        # read the whole manifest first, so a bad line stops the run before anything is paid for
+        return publish_zonefiles(config, list(zonefile_pairs(from_dir, manifest)), concurrency, dry_run)
+    if name is None or zonefile is None:
+        raise click.UsageError("NAME and ZONEFILE are required unless --from_dir or --manifest is given")
+    r = config.client.set_zonefile(name, zonefile.read().decode('utf-8'), raw=True)
+    output(config, r)
 
 # blockstack-cli name get_zonefile
 # https://blockstack.github.io/blockstack-core/#managing-names-fetch-zone-file
@@ -383,34 +2915,80 @@ def set_zonefile(config, name, zonefile):
 @pass_config    
 def get_zonefile(config, name):
     """get zonefile for NAME"""
-    path = "/v1/names/{}/zonefile".format(name)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    # the zonefile store is keyed by hash, so it only saves a round trip when --cache
+    # already holds the name record; looking the hash up would cost the round trip it saves
+    record = config.client.cached("/v1/names/{}".format(name))
+    zonefile_hash = record.json().get('zonefile_hash') if record is not None and record.ok and record.text else None
+    if zonefile_hash and output_cached_zonefile(config, zonefile_hash):
+        return
+    r = config.client.get_zonefile(name, raw=True)
+    if zonefile_hash:
+        cache_zonefile(config, zonefile_hash, r)
+    output(config, r)
 
 # blockstack-cli name get_page
 # https://blockstack.github.io/blockstack-core/#name-querying-get-all-names
 @name.command()
-@click.argument('PAGE')
+@click.argument('PAGE', required=False)
+@click.option('--all', 'all_pages', is_flag=True, help='stream every page as NDJSON instead of fetching PAGE')
+@click.option('--workers', default=8, help='pages fetched concurrently with --all')
+@click.option('--ordered', is_flag=True, help='with --all, write names in page order')
 @pass_config
-def get_page(config,page):
+def get_page(config,page,all_pages,workers,ordered):
     """get a page from the list all blockstack names"""
-    path = "/v1/names?page={}".format(page)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    if all_pages:
+        return stream_pages(config, config.client.get_names_page, workers, ordered)
+    if page is None:
+        raise click.UsageError("PAGE is required unless --all is given")
+    r = config.client.get_names_page(page, raw=True)
+    output(config, r)
 
 # blockstack-cli name get
 # https://blockstack.github.io/blockstack-core/#name-querying-get-name-info
 @name.command()
-@click.argument('NAME')
+@click.argument('NAME', required=False)
+@click.option('--from_file', type=click.File('r'), help='look up every name listed in this file (- for STDIN), one per line, as NDJSON')
+@click.option('--concurrency', default=16, help='lookups in flight at once with --from_file')
+@click.option('--ordered', is_flag=True, help='with --from_file, write results in input order')
+@click.option('--watch', 'interval', type=float, default=None, help='poll every INTERVAL seconds and print only changes, as NDJSON')
 @pass_config
-def get(config,name):
+def get(config,name,from_file,concurrency,ordered,interval):
     """get details for a name"""
-    path = "/v1/names/{}".format(name)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    if from_file and interval:
+        raise click.UsageError("--watch works on a single NAME, not --from_file")
+    if from_file:
+        return stream_lookups(config, 'name', read_lines(from_file), config.client.get_name, concurrency, ordered)
+    if name is None:
+        raise click.UsageError("NAME is required unless --from_file is given")
+    if interval:
+        return watch(config, lambda **kw: config.client.get_name(name, raw=True, **kw), interval)
+    r = config.client.get_name(name, raw=True)
+    output(config, r)
+
+# blockstack-cli name available
+# https://blockstack.github.io/blockstack-core/#name-querying-get-name-info
+@name.command()
+@click.argument('NAME', required=False)
+@click.option('--from_file', type=click.File('r'), help='check every name listed in this file (- for STDIN), one per line, as NDJSON')
+@click.option('--concurrency', default=16, help='lookups in flight at once confirming possible matches')
+@click.option('--workers', default=8, help='pages fetched concurrently when building a namespace filter')
+@click.option('--fp_rate', default=0.001, help='false positive rate of the namespace filters, each one costs a lookup')
+@click.option('--refresh', is_flag=True, help='rebuild the namespace filters even if the consensus hash has not moved')
+@pass_config
+def available(config,name,from_file,concurrency,workers,fp_rate,refresh):
+    """check whether names are free to register"""
+    if not 0 < fp_rate < 1:
+        raise click.BadParameter("must be between 0 and 1", param_hint='--fp_rate')
+    if not from_file:
+        if name is None:
+            raise click.UsageError("NAME is required unless --from_file is given")
+        # one name is a single lookup, cheaper than building its namespace's filter
+        r = config.client.get_name(name, raw=True)
+        if r.status_code != 404 and not r.ok:
+            raise BlockstackAPIError(r)
+        return output_data(config, {'name': name, 'available': r.status_code == 404})
+    filters = AvailabilityFilters(config, os.path.join(config.cache_dir, 'filters'), workers, fp_rate, refresh)
+    check_availability(config, filters, read_lines(from_file), concurrency)
 
 # blockstack-cli name history
 # https://blockstack.github.io/blockstack-core/#name-querying-name-history
@@ -419,10 +2997,9 @@ def get(config,name):
 @pass_config
 def history(config,name):
     """get the transfer history for a name"""
-    path = "/v1/names/{}/history".format(name)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_name_history(name, raw=True)
+    # --fields, --where, csv and table see one record per operation
+    output(config, r, records=history_records)
 
 # blockstack-cli name zonefile_history
 # https://blockstack.github.io/blockstack-core/#name-querying-get-historical-zone-file
@@ -432,10 +3009,11 @@ def history(config,name):
 @pass_config
 def zonefile_history(config,name,zonefilehash):
     """zonefile_history name thing"""
-    path = "/v1/names/{}/zonefile/{}".format(name,zonefilehash)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    if output_cached_zonefile(config, zonefilehash):
+        return
+    r = config.client.get_historic_zonefile(name, zonefilehash, raw=True)
+    cache_zonefile(config, zonefilehash, r)
+    output(config, r)
 
 # blockstack-cli name address
 # https://blockstack.github.io/blockstack-core/#name-querying-get-names-owned-by-address
@@ -445,10 +3023,8 @@ def zonefile_history(config,name,zonefilehash):
 @pass_config
 def address(config,address,blockchain):
     """address name thing"""
-    path = "/v1/addresses/{}/{}".format(blockchain,address)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_names_owned(address, blockchain, raw=True)
+    output(config, r)
 
 ###########################
 # GROUP: PRICE
@@ -467,22 +3043,55 @@ def price(config):
 @pass_config
 def namespace(config,namespace):
     """get the price for a namespace"""
-    path = "/v1/prices/namespaces/{}".format(namespace)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_namespace_price(namespace, raw=True)
+    output(config, r)
 
 # blockstack-cli price name 
 # https://blockstack.github.io/blockstack-core/#price-checks-get-name-price
 @price.command()
-@click.argument('name')
+@click.argument('name', required=False)
+@click.option('--local', is_flag=True, help="price from the namespace's pricing parameters instead of asking the node")
+@click.option('--from_file', type=click.File('r'), help='price every name listed in this file (- for STDIN) locally, as NDJSON')
+@click.option('--verify', default=0, help='check this many randomly sampled local prices against the node')
+@click.option('--multiplier', default=1.0, help='epoch price multiplier the node applies on top of namespace pricing')
+@click.option('--refresh', is_flag=True, help='re-fetch cached namespace pricing parameters')
 @pass_config
-def name(config,name):
+def name(config,name,local,from_file,verify,multiplier,refresh):
     """get the price for a name"""
-    path = "/v1/prices/names/{}".format(name)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    import random
+    if not local and not from_file:
+        if name is None:
+            raise click.UsageError("NAME is required unless --from_file is given")
+        r = config.client.get_name_price(name, raw=True)
+        return output(config, r)
+
+    engine = PriceEngine(config.client, os.path.join(config.cache_dir, 'namespaces'), multiplier, refresh)
+    if not from_file:
+        satoshis = engine.price(name)
+        output_data(config, {'name': name, 'satoshis': satoshis})
+        if verify and not verify_prices(config, [(name, satoshis)]):
+            sys.exit(1)
+        return
+
+    # reservoir-sample the names to verify so the candidate list is streamed, never held in memory
+    sample = []
+    priced = 0
+    for candidate in read_lines(from_file):
+        try:
+            record = {'name': candidate, 'satoshis': engine.price(candidate)}
+        except click.ClickException as e:
+            record = {'name': candidate, 'error': e.format_message()}
+        write_record(config, record)
+        if verify and 'satoshis' in record:
+            priced += 1
+            if len(sample) < verify:
+                sample.append((candidate, record['satoshis']))
+            else:
+                j = random.randint(0, priced - 1)
+                if j < verify:
+                    sample[j] = (candidate, record['satoshis'])
+    if sample and not verify_prices(config, sample):
+        sys.exit(1)
 
 
 ###########################
@@ -502,35 +3111,46 @@ def blockchain(config):
 @pass_config
 def get_consensus(config,blockchain):
     """get_consensus hash from the connected blockchain node"""
-    path = "/v1/blockchains/{}/consensus".format(blockchain)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_consensus(blockchain, raw=True)
+    output(config, r)
 
 # blockstack-cli blockchain get_pending
 # https://blockstack.github.io/blockstack-core/#blockchain-operations-get-pending-transactions    
 @blockchain.command()
 @click.option('--blockchain', default='bitcoin', help='blockchain to which address belongs. Currently only bitcoin is supported')
+@click.option('--watch', 'interval', type=float, default=None, help='poll every INTERVAL seconds and print only changes, as NDJSON')
 @pass_config
-def get_pending(config,blockchain):
+def get_pending(config,blockchain,interval):
     """get_pending transactions from connected blockchain node"""
-    path = "/v1/blockchains/{}/pending".format(blockchain)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    if interval:
+        return watch(config, lambda **kw: config.client.get_pending(blockchain, raw=True, **kw), interval)
+    r = config.client.get_pending(blockchain, raw=True)
+    output(config, r)
 
 # blockstack-cli blockchain get_utxo
 # https://blockstack.github.io/blockstack-core/#blockchain-operations-get-unspent-outputs
 @blockchain.command()
 @click.option('--blockchain', default='bitcoin', help='blockchain to which address belongs. Currently only bitcoin is supported')
-@click.argument('ADDRESS')
+@click.argument('ADDRESS', required=False)
+@click.option('--from_file', type=click.File('r'), help='sweep every address listed in this file (- for STDIN), one per line, as NDJSON ending in a totals line')
+@click.option('--concurrency', default=16, help='addresses fetched at once with --from_file')
+@click.option('--ordered', is_flag=True, help='with --from_file, write addresses in input order')
+@click.option('--min_confirmations', default=0, help='only keep and count outputs with at least this many confirmations')
+@click.option('--no_cache', is_flag=True, help='with --from_file, ask the node for every address even if it answered at this consensus hash already')
 @pass_config
-def get_utxo(config,blockchain,address):
+def get_utxo(config,blockchain,address,from_file,concurrency,ordered,min_confirmations,no_cache):
     """get unspent transaction outputs from an ADDRESS"""
-    path = "/v1/blockchains/{}/{}/unspent".format(blockchain,address)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    if from_file:
+        # unconfirmed outputs can lag by up to a block, the rest can not change until the next one
+        if not no_cache:
+            config.response_cache([CACHEABLE_PATHS['utxo']])
+        return sweep_utxos(config, blockchain, read_lines(from_file), concurrency, ordered, min_confirmations)
+    if address is None:
+        raise click.UsageError("ADDRESS is required unless --from_file is given")
+    r = config.client.get_utxo(address, blockchain, raw=True)
+    if min_confirmations and r.ok:
+        return output_data(config, [u for u in r.json() if u.get('confirmations', 0) >= min_confirmations])
+    output(config, r)
 
 # blockstack-cli blockchain send_transaction
 # https://blockstack.github.io/blockstack-core/#blockchain-operations-broadcast-transaction
@@ -697,21 +3317,140 @@ def namespace(config):
 @pass_config
 def all(config):
     """get a list of all namespaces"""
-    path = "/v1/namespaces".format(blockchain,address)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    r = config.client.get_namespaces(raw=True)
+    output(config, r)
 
 # blockstack-cli namespace names
 # https://blockstack.github.io/blockstack-core/#namespace-operations-get-namespace-names
 @namespace.command()
 @click.option('-tld', default='id', help='top level domain to look for names in...')
-@click.argument("PAGE")
+@click.argument("PAGE", required=False)
+@click.option('--all', 'all_pages', is_flag=True, help='stream every page as NDJSON instead of fetching PAGE')
+@click.option('--workers', default=8, help='pages fetched concurrently with --all')
+@click.option('--ordered', is_flag=True, help='with --all, write names in page order')
 @pass_config
-def names(config,page,tld):
+def names(config,page,tld,all_pages,workers,ordered):
     """get a PAGE of names from a -tld"""
-    path = "/v1/namespaces/{}/names?page={}".format(tld,page)
-    url = create_url(config,path)
-    r = requests.get(url, headers=make_headers(config))
-    output(config, url, r)
+    if all_pages:
+        return stream_pages(config, functools.partial(config.client.get_namespace_names, tld), workers, ordered)
+    if page is None:
+        raise click.UsageError("PAGE is required unless --all is given")
+    r = config.client.get_namespace_names(tld, page, raw=True)
+    output(config, r)
+
+# blockstack-cli namespace export
+# https://blockstack.github.io/blockstack-core/#namespace-operations-get-namespace-names
+@namespace.command()
+@click.argument("TLD")
+@click.option('--format', 'export_format', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv', help='csv, or parquet (needs pyarrow)')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='file to write, STDOUT by default')
+@click.option('--columns', default='', help='comma separated columns to add after the name: {}'.format(','.join(EXPORT_COLUMNS)))
+@click.option('--row_group', default=5000, help='names fetched and written at a time, bounds memory')
+@click.option('--workers', default=8, help='requests in flight')
+@pass_config
+def export(config, tld, export_format, output, columns, row_group, workers):
+    """write every name in the TLD namespace as csv or parquet"""
+    columns = [c.strip() for c in columns.split(',') if c.strip()]
+    unknown = [c for c in columns if c not in EXPORT_COLUMNS]
+    if unknown:
+        raise click.UsageError("unknown column {}, pick from {}".format(', '.join(unknown), ','.join(EXPORT_COLUMNS)))
+    columns = [c for c in EXPORT_COLUMNS if c in columns]
+    if row_group < 1:
+        raise click.UsageError("--row_group must be at least 1")
+    export_namespace(config, tld, export_format, output, columns, workers, row_group)
+
+
+
+###########################
+# GROUP: MIRROR
+# blockstack-cli mirror
+###########################
+@cli.group()
+@pass_config
+def mirror(config):
+    """keep a local SQLite copy of the name database for offline queries"""
+    pass
+
+# blockstack-cli mirror sync
+@mirror.command()
+@click.option('--db', default=None, help='mirror database, defaults to mirror.db in --cache_dir')
+@click.option('-tld', default=None, help='only mirror names in this namespace')
+@click.option('--workers', default=16, help='requests in flight at once')
+@click.option('--max_age', default=86400, help='also re-fetch mirrored names last synced more than this many seconds ago while the chain has not moved')
+@click.option('--full', is_flag=True, help='re-fetch every name, even if the chain has not moved')
+@pass_config
+def sync(config, db, tld, workers, max_age, full):
+    """fill the local mirror, refreshing every name once the chain moves and stale ones otherwise"""
+    import time
+    db = open_mirror(config, db, create=True)
+    scope = tld or '*'
+    consensus = config.client.get_consensus().get('consensus_hash')
+    last = db.execute("SELECT value FROM meta WHERE key = ?", ('consensus_hash:' + scope,)).fetchone()
+    summary = {'consensus_hash': consensus, 'added': 0, 'removed': 0, 'refreshed': 0, 'errors': 0}
+    now = time.time()
 
+    if last and last[0] == consensus and not full:
+        # the chain has not moved, so no name has either; only --max_age sends any back to the node
+        if tld is None:
+            rows = db.execute("SELECT name, 0 FROM names WHERE synced_at < ?", (now - max_age,))
+        else:
+            rows = db.execute("SELECT name, 0 FROM names WHERE namespace = ? AND synced_at < ?", (tld, now - max_age))
+    else:
+        # spill the name listing to a temp table so memory stays flat however big the namespace is
+        db.execute("CREATE TEMP TABLE seen (name TEXT PRIMARY KEY)")
+        if tld is None:
+            fetch_page = config.client.get_names_page
+        else:
+            fetch_page = functools.partial(config.client.get_namespace_names, tld)
+        db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", ((n,) for n in iter_pages(config, fetch_page, workers)))
+        if tld is None:
+            summary['removed'] = db.execute("DELETE FROM names WHERE name NOT IN (SELECT name FROM seen)").rowcount
+        else:
+            summary['removed'] = db.execute("DELETE FROM names WHERE namespace = ? AND name NOT IN (SELECT name FROM seen)", (tld,)).rowcount
+        # the api has no list of the names a new block touched, and any of them may have changed
+        # owner or zonefile since, so a new consensus hash sends every name back to the node
+        rows = db.execute("SELECT seen.name, names.name IS NULL FROM seen LEFT JOIN names ON names.name = seen.name")
+    # name -> whether the mirror lacks it yet
+    stale = collections.OrderedDict(rows)
+
+    for i, (n, r, error) in enumerate(fetch_map(config, config.client.get_name, list(stale), workers), 1):
+        record = lookup('name', n, r, error)
+        if 'result' in record:
+            mirror_record(db, record['name'], record['result'], now)
+            summary['added' if stale[n] else 'refreshed'] += 1
+        else:
+            summary['errors'] += 1
+        if i % 1000 == 0:
+            db.commit()
+    if not summary['errors']:
+        db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", ('consensus_hash:' + scope, consensus))
+    db.commit()
+    summary['names'] = db.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+    output_data(config, summary)
+
+# blockstack-cli mirror query
+@mirror.command()
+@click.argument('NAME', required=False)
+@click.option('--db', default=None, help='mirror database, defaults to mirror.db in --cache_dir')
+@click.option('--prefix', default=None, help='list names starting with PREFIX')
+@click.option('--owner', default=None, help='list names owned by this address')
+@click.option('--limit', default=100, help='max names returned by --prefix and --owner')
+@pass_config
+def query(config, name, db, prefix, owner, limit):
+    """look up NAME, a --prefix or an --owner in the local mirror"""
+    import json
+    if len([q for q in (name, prefix, owner) if q is not None]) != 1:
+        raise click.UsageError("give exactly one of NAME, --prefix or --owner")
+    db = open_mirror(config, db)
+    if name is not None:
+        row = db.execute("SELECT record FROM names WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise click.ClickException("{} is not in the mirror".format(name))
+        return output_data(config, json.loads(row[0]))
+    if prefix is not None:
+        # a range scan on the primary key, LIKE would skip the index
+        rows = db.execute("SELECT record FROM names WHERE name >= ? AND name < ? ORDER BY name LIMIT ?",
+                          (prefix, prefix + u'\uffff', limit))
+    else:
+        rows = db.execute("SELECT record FROM names WHERE address = ? ORDER BY name LIMIT ?", (owner, limit))
+    output_data(config, [json.loads(row[0]) for row in rows])
@@ -0,0 +1,176 @@
+"""asyncio transport for the bulk commands of blockstack-cli, picked with --transport asyncio
+
+Hundreds of requests stay in flight on one event loop, with at most --pool_size
+connections open to each node, instead of a thread per request. Needs python 3
+and aiohttp (pip install 'blockstack-cli[asyncio]'), so cli.py only imports this
+module once a bulk command runs with that transport.
+"""
+import asyncio
+import collections
+import functools
+import itertools
+import json
+import time
+
+import click
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    raise click.UsageError("--transport asyncio needs aiohttp, pip install 'blockstack-cli[asyncio]'")
+
+import cli
+
+class Recorder(cli.BlockstackClient):
+    """a client whose request() returns what it would have sent, so the endpoint methods double as request builders"""
+
+    def request(self, method, path, raw=False, headers=None, **kwargs):
+        return method, path, headers, kwargs
+
+Request = collections.namedtuple('Request', ['method', 'url', 'headers', 'body'])
+
+class Response(object):
+    """the parts of requests.Response the CLI reads, filled from an aiohttp response"""
+
+    def __init__(self, request, status_code, headers, url, content):
+        self.request = request
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.url = url
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+async def admit(admission, host, released):
+    """wait for a slot on HOST from the shared cli.AdmissionController without blocking the loop"""
+    while True:
+        wait = admission.admit(host)
+        if wait is None:
+            return
+        # a request finishing may free a slot long before WAIT is up
+        try:
+            await asyncio.wait_for(released.wait(), wait)
+        except asyncio.TimeoutError:
+            pass
+
+def release(admission, released, host, seconds, status, retry_after=None):
+    admission.release(host, seconds, status, retry_after)
+    # wakes every coroutine waiting right now, the clear only affects later ones
+    released.set()
+    released.clear()
+
+async def send(session, client, spec, released):
+    """send one recorded request, failing reads over across client.hosts the way the thread transport does"""
+    method, path, headers, kwargs = spec
+    headers = dict(client.headers(), **(headers or {}))
+    # aiohttp only takes str query values, the endpoint methods pass pages as ints
+    params = dict((k, str(v)) for k, v in kwargs.get('params', {}).items()) or None
+    body = kwargs.get('json')
+    key = client.cache.key(path, params) if client.cache is not None and method == 'GET' else None
+    r = client.cache.get(key, client.url(key), headers) if key is not None else None
+    if r is not None:
+        return r
+    routed = method == 'GET' and len(client.hosts) > 1 and cli.ROUTED_PATHS.match(path) is not None
+    r, error = None, None
+    for host in client.ranked_hosts() if routed else [client.host]:
+        if client.admission is not None:
+            await admit(client.admission, host, released)
+        start = time.time()
+        record = {'time': round(start, 3), 'method': method, 'url': client.url(path, host)}
+        try:
+            async with session.request(method, client.url(path, host), headers=headers, params=params, json=body) as resp:
+                first_byte = time.time()
+                content = await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if client.admission is not None:
+                release(client.admission, released, host, time.time() - start, None)
+            error = requests.ConnectionError("{} {}: {}".format(method, client.url(path, host), e))
+            if routed:
+                client.stats[host].fail()
+            if client.tracer is not None:
+                client.tracer.records.append(dict(record, error=str(e), total=time.time() - start))
+            continue
+        end = time.time()
+        if client.admission is not None:
+            release(client.admission, released, host, end - start, resp.status, resp.headers.get('Retry-After'))
+        request = Request(method, str(resp.url), headers, None if body is None else json.dumps(body))
+        r = Response(request, resp.status, resp.headers, str(resp.url), content)
+        if client.tracer is not None:
+            # aiohttp does not expose its connection phases, so a trace gets ttfb and download only
+            record.update(status=r.status_code, bytes=len(content), ttfb=first_byte - start, download=end - first_byte, total=end - start)
+            client.tracer.records.append(record)
+            r.trace = record
+        if key is not None:
+            client.cache.put(key, r)
+        if not routed:
+            return r
+        client.stats[host].record(first_byte - start)
+        if r.status_code < 500:
+            return r
+        client.stats[host].fail()
+    if r is not None:
+        return r
+    raise error
+
+async def make_session(client):
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=client.pool_size)
+    # match requests, which waits on a slow node for as long as it takes
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None))
+
+async def make_event():
+    # python < 3.10 ties an Event to the loop running when it is made
+    return asyncio.Event()
+
+def fetch_map(client, fetch, items, workers, ordered=False):
+    """the asyncio half of cli.fetch_map, yielding (item, response, error) with WORKERS requests in flight"""
+    if isinstance(fetch, functools.partial):
+        name, args, keywords = fetch.func.__name__, fetch.args, fetch.keywords or {}
+    else:
+        name, args, keywords = fetch.__name__, (), {}
+    build = getattr(Recorder(','.join(client.hosts), client.password), name)
+    if len(client.hosts) > 1 and not client._checked:
+        client.check_hosts()
+
+    loop = asyncio.new_event_loop()
+    session = loop.run_until_complete(make_session(client))
+    released = loop.run_until_complete(make_event())
+
+    async def attempt(item):
+        try:
+            return item, await send(session, client, build(*(args + (item,)), **keywords), released), None
+        except requests.RequestException as e:
+            return item, None, e
+
+    items = iter(items)
+    inflight = collections.deque(loop.create_task(attempt(item)) for item in itertools.islice(items, workers))
+    try:
+        while inflight:
+            if ordered:
+                done = [inflight.popleft()]
+                loop.run_until_complete(done[0])
+            else:
+                done, _ = loop.run_until_complete(asyncio.wait(list(inflight), return_when=asyncio.FIRST_COMPLETED))
+                for task in done:
+                    inflight.remove(task)
+            for item in itertools.islice(items, len(done)):
+                inflight.append(loop.create_task(attempt(item)))
+            for task in done:
+                yield task.result()
+    finally:
+        # only left over when the caller stopped early
+        if inflight:
+            for task in inflight:
+                task.cancel()
+            loop.run_until_complete(asyncio.wait(list(inflight)))
+        loop.run_until_complete(session.close())
+        loop.close()
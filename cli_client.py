@@ -0,0 +1,113 @@
+"""thin entry point for blockstack-cli, handing argv to a running `blockstack-cli serve`
+
+When the daemon's socket answers, the command runs in that warm process, with its
+imports, keep-alive connections and caches already in place, and this process only
+relays STDIN, STDOUT, STDERR and the exit code. Without a daemon (or while it is busy
+with another command) the command runs here as usual. Only the standard library
+modules below are imported on the forwarding path.
+"""
+import json
+import os
+import socket
+import struct
+import sys
+
+# every message on the socket is one frame: a channel byte, a 4 byte length, the payload
+#   client -> daemon: a (argv, cwd and BLOCKSTACK_CLI_* env as JSON), 0 (STDIN, empty at EOF)
+#   daemon -> client: r (ready) or b (busy, run it yourself), 1 (STDOUT), 2 (STDERR), x (exit code)
+FRAME_HEADER = struct.Struct('>cI')
+
+def socket_path():
+    default = os.path.join(os.environ.get('BLOCKSTACK_CLI_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.blockstack-cli'), 'serve.sock')
+    return os.environ.get('BLOCKSTACK_CLI_SOCKET') or default
+
+def send_frame(sock, channel, data):
+    sock.sendall(FRAME_HEADER.pack(channel, len(data)) + data)
+
+def recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def read_frame(sock):
+    """(channel, payload), or (None, None) once the other end hangs up"""
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None, None
+    channel, size = FRAME_HEADER.unpack(header)
+    data = recv_exact(sock, size)
+    if data is None:
+        return None, None
+    return channel, data
+
+def pump_stdin(sock):
+    try:
+        while True:
+            data = os.read(0, 65536)
+            send_frame(sock, b'0', data)
+            if not data:
+                return
+    except (OSError, socket.error):
+        # the command finished without reading all of it
+        return
+
+def connect():
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        # a socket left behind by a daemon that died
+        sock.close()
+        return None
+    return sock
+
+def forward(sock, argv):
+    """run ARGV in the daemon, returning its exit code, or None when the daemon is busy"""
+    import threading
+    env = dict((k, v) for k, v in os.environ.items() if k.startswith('BLOCKSTACK_CLI_'))
+    send_frame(sock, b'a', json.dumps({'argv': argv, 'cwd': os.getcwd(), 'env': env}).encode('utf-8'))
+    channel, _ = read_frame(sock)
+    if channel != b'r':
+        return None
+    pump = threading.Thread(target=pump_stdin, args=(sock,))
+    pump.daemon = True
+    pump.start()
+    streams = {b'1': getattr(sys.stdout, 'buffer', sys.stdout), b'2': getattr(sys.stderr, 'buffer', sys.stderr)}
+    while True:
+        channel, data = read_frame(sock)
+        if channel is None:
+            sys.stderr.write("blockstack-cli serve went away mid-command\n")
+            return 1
+        if channel == b'x':
+            return int(data)
+        try:
+            streams[channel].write(data)
+            streams[channel].flush()
+        except IOError:
+            # our reader went away, say `| head`, and hanging up stops the command too
+            return 1
+
+def main():
+    argv = sys.argv[1:]
+    if argv[:1] != ['serve'] and not os.environ.get('BLOCKSTACK_CLI_NO_DAEMON'):
+        sock = connect()
+        if sock is not None:
+            try:
+                code = forward(sock, argv)
+            finally:
+                sock.close()
+            if code is not None:
+                sys.exit(code)
+    import cli
+    cli.cli()
+
+if __name__ == '__main__':
+    main()
@@ -3,15 +3,21 @@ from setuptools import setup
 setup(
     name="blockstack-cli",
     version="0.1",
-    py_modules=['cli'],
+    py_modules=['cli', 'cli_aio', 'cli_client'],
     install_requires=[
         'Click',
         'requests',
         'toml',
         'pyyaml',
+        'futures; python_version < "3"',
     ],
+    extras_require={
+        'asyncio': ['aiohttp; python_version >= "3.6"'],
+        'parquet': ['pyarrow'],
+        'wallet': ['coincurve'],
+    },
     entry_points='''
         [console_scripts]
-        blockstack-cli=cli:cli
+        blockstack-cli=cli_client:main
     ''',
 )
\ No newline at end of file
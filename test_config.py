@@ -0,0 +1,69 @@
+"""the plans `config apply` works out, checked without a node
+
+    $ python -m pytest test_config.py    (or python -m unittest test_config)
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cli
+
+def node_config():
+    # what a node set up from the default template reports, every value a string
+    config = cli.make_default_config()
+    return dict((section, dict((key, cli.config_text(value)) for key, value in values.items()))
+                for section, values in config.items())
+
+def sets(plan):
+    return dict(((change['section'], change['key']), change['new']) for change in plan if change['op'] == 'set')
+
+class TestConfigPlan(unittest.TestCase):
+
+    def test_docker_template_flips_bind_and_host(self):
+        plan = list(cli.config_plan(node_config(), {}, cli.make_docker_config(), False))
+        self.assertEqual(sets(plan), {
+            ('blockstack-client', 'api_endpoint_bind'): '0.0.0.0',
+            ('blockstack-client', 'api_endpoint_host'): '0.0.0.0',
+        })
+        self.assertEqual([change.get('old') for change in plan], ['localhost', 'localhost'])
+
+    def test_template_keeps_api_password_and_paths(self):
+        current = node_config()
+        current['blockstack-client']['queue_path'] = '/home/node/.blockstack/queues.db'
+        self.assertEqual(list(cli.config_plan(current, {}, cli.make_default_config(), False)), [])
+
+    def test_template_fills_missing_api_password(self):
+        current = node_config()
+        del current['blockstack-client']['api_password']
+        plan = list(cli.config_plan(current, {}, cli.make_default_config(), False))
+        self.assertEqual([(change['section'], change['key']) for change in plan], [('blockstack-client', 'api_password')])
+
+    def test_desired_wins_over_template(self):
+        desired = {'blockstack-client': {'api_endpoint_bind': '10.0.0.1', 'api_password': 'hunter2'}}
+        plan = list(cli.config_plan(node_config(), desired, cli.make_docker_config(), False))
+        self.assertEqual(sets(plan), {
+            ('blockstack-client', 'api_endpoint_bind'): '10.0.0.1',
+            ('blockstack-client', 'api_endpoint_host'): '0.0.0.0',
+            ('blockstack-client', 'api_password'): 'hunter2',
+        })
+
+    def test_prune(self):
+        current = node_config()
+        current['old'] = {'k': 'v'}
+        current['bitcoind']['extra'] = '1'
+        plan = list(cli.config_plan(current, {}, cli.make_default_config(), True))
+        self.assertEqual(plan, [
+            {'op': 'delete', 'section': 'bitcoind', 'key': 'extra', 'old': '1'},
+            {'op': 'delete_section', 'section': 'old'},
+        ])
+
+    def test_applied_plan_is_empty_the_second_time(self):
+        current = node_config()
+        for change in cli.config_plan(current, {}, cli.make_docker_config(), False):
+            current[change['section']][change['key']] = cli.config_text(change['new'])
+        self.assertEqual(list(cli.config_plan(current, {}, cli.make_docker_config(), False)), [])
+
+if __name__ == '__main__':
+    unittest.main()
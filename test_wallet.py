@@ -0,0 +1,160 @@
+"""known answers for the offline parts of `wallet send`: keys, addresses, signing and coin selection
+
+    $ python -m pytest test_wallet.py    (or python -m unittest test_wallet)
+
+Signing needs coincurve (pip install 'blockstack-cli[wallet]'), those tests are skipped without it.
+"""
+import binascii
+import hashlib
+import os
+import sys
+import unittest
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cli
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+KEY_ONE_WIF = 'KwDiBf89QgGbjEhKnhXJuH7LrciVrZi3qYjgd9M7rFU73sVHnoWn'
+KEY_ONE_PUBKEY = '0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'
+# the secp256k1 RFC 6979 vector: key 1 signing sha256("Satoshi Nakamoto")
+SATOSHI_SIGNATURE = ('3045022100934b1ea10a4b3c1757e2b0c017d0b6143ce3c9a7e6a4a49860d7a6ab210ee3d8'
+                     '02202442ce9d2b916064108014783e923ec36b49743e2ffa1c4496f01a512aafd9e5')
+# key 1 spending two outputs to a P2SH address, with change back to itself
+SIGNED_TX = (
+    '0100000002111111111111111111111111111111111111111111111111111111111111111100000000'
+    '6b483045022100981f0fb7c3ecb4c56bcb041d83499cacf93e767fb472f527e88c4d9a32018e0602203b'
+    '63ac3ff97cff24911b7bb047278743e2589c03126065124e663d03a24c428801210279be667ef9dcbbac'
+    '55a06295ce870b07029bfcdb2dce28d959f2815b16f81798ffffffff2222222222222222222222222222'
+    '222222222222222222222222222222222222030000006b483045022100ebda5b0bc482205a1ff0a889f1'
+    'f1182b5ed8bcc351186780264a6b81ac9620e3022038a1eea381cd44343ba2156d7693a661c2a2c67754'
+    '6fbc94a588434840a42f4301210279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b'
+    '16f81798ffffffff0250c300000000000017a914e9c3dd0c07aac76179ebc76a6c78d4d67c6c160a8739'
+    '300000000000001976a914751e76e8199196d454941c45d1b3a323f1433bd688ac00000000')
+
+def hexlify(data):
+    return binascii.hexlify(data).decode('ascii')
+
+class TestHashes(unittest.TestCase):
+
+    VECTORS = [
+        (b'', '9c1185a5c5e9fc54612808977ee8f548b2258d31'),
+        (b'abc', '8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'),
+        (b'message digest', '5d0689ef49d2fae572b881b123a85ffa21595f36'),
+        (b'1234567890' * 8, '9b752e45573d4b39f4dbd3323cab82bf63326bfb'),
+    ]
+
+    def test_ripemd160(self):
+        for data, digest in self.VECTORS:
+            self.assertEqual(hexlify(cli.ripemd160(data)), digest)
+
+    def test_ripemd160_without_openssl(self):
+        new = hashlib.new
+        def no_ripemd(name, *args):
+            if name == 'ripemd160':
+                raise ValueError("unsupported hash type")
+            return new(name, *args)
+        hashlib.new = no_ripemd
+        try:
+            for data, digest in self.VECTORS:
+                self.assertEqual(hexlify(cli.ripemd160(data)), digest)
+        finally:
+            hashlib.new = new
+
+class TestKeysAndAddresses(unittest.TestCase):
+
+    def test_wif(self):
+        secret, compressed, network = cli.parse_private_key(KEY_ONE_WIF)
+        self.assertEqual(hexlify(secret), '00' * 31 + '01')
+        self.assertEqual((compressed, network), (True, 'mainnet'))
+        secret, compressed, network = cli.parse_private_key('5HueCGU8rMjxEXxiPuD5BDku4MkFqeZyd4dZ1jvhTVqvbTLvyTJ')
+        self.assertEqual(hexlify(secret), '0c28fca386c7a227600b2fe50b7cae11ec86d3bf1fbe471be89827e19d72aa1d')
+        self.assertEqual((compressed, network), (False, 'mainnet'))
+
+    def test_hex_key(self):
+        self.assertEqual(cli.parse_private_key('00' * 31 + '0101'), (binascii.unhexlify('00' * 31 + '01'), True, None))
+        self.assertRaises(click.BadParameter, cli.parse_private_key, 'not a key')
+
+    def test_address_of_key_one(self):
+        self.assertEqual(cli.b58check_encode(0x00, cli.hash160(binascii.unhexlify(KEY_ONE_PUBKEY))), '1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMH')
+
+    def test_decode_address(self):
+        self.assertEqual(cli.decode_address('1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMH'),
+                         ('mainnet', binascii.unhexlify('76a914751e76e8199196d454941c45d1b3a323f1433bd688ac')))
+        self.assertEqual(cli.decode_address('3P14159f73E4gFr7JterCCQh9QjiTjiZrG'),
+                         ('mainnet', binascii.unhexlify('a914e9c3dd0c07aac76179ebc76a6c78d4d67c6c160a87')))
+        self.assertRaises(click.BadParameter, cli.decode_address, '1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMX')
+
+@unittest.skipIf(coincurve is None, "needs coincurve")
+class TestSigning(unittest.TestCase):
+
+    def setUp(self):
+        self.key = cli.signing_key(cli.parse_private_key(KEY_ONE_WIF)[0])
+
+    def test_public_key(self):
+        self.assertEqual(hexlify(self.key.public_key.format(True)), KEY_ONE_PUBKEY)
+
+    def test_rfc6979_signature(self):
+        self.assertEqual(hexlify(self.key.sign(hashlib.sha256(b'Satoshi Nakamoto').digest(), hasher=None)), SATOSHI_SIGNATURE)
+
+    def test_signed_transaction(self):
+        change = binascii.unhexlify('76a914751e76e8199196d454941c45d1b3a323f1433bd688ac')
+        _, pay = cli.decode_address('3P14159f73E4gFr7JterCCQh9QjiTjiZrG')
+        tx = cli.sign_p2pkh([('11' * 32, 0), ('22' * 32, 3)], [(50000, pay), (12345, change)], self.key, True, change)
+        self.assertEqual(hexlify(tx), SIGNED_TX)
+
+    def test_key_out_of_range(self):
+        self.assertRaises(click.BadParameter, cli.signing_key, b'\0' * 32)
+
+# 1 satoshi per byte: a P2PKH input costs 148, a payment to P2PKH 44 with the overhead, change 34
+FEE_RATE, INPUT, BASE, CHANGE = 1, 148, 44, 34
+
+def coins(*values):
+    return [{'transaction_hash': '{:064x}'.format(i), 'output_index': 0, 'value': v} for i, v in enumerate(values)]
+
+class TestCoinSelection(unittest.TestCase):
+
+    def test_branch_and_bound_finds_exact_match(self):
+        # largest first would take 5 and overshoot, 4 + 3 hits the target
+        self.assertEqual(cli.branch_and_bound([5, 4, 3], 7, 0), [1, 2])
+
+    def test_branch_and_bound_without_match(self):
+        self.assertEqual(cli.branch_and_bound([5, 4], 6, 1), None)
+        self.assertEqual(cli.branch_and_bound([5, 4], 10, 100), None)
+
+    def test_branch_and_bound_gives_up_after_max_tries(self):
+        # every value is even, so an odd target is never met, only the cap stops the search
+        self.assertEqual(cli.branch_and_bound(list(range(80, 0, -2)), 401, 0, max_tries=1000), None)
+
+    def test_exact_match_needs_no_change(self):
+        selected, change, fee, how = cli.select_coins(coins(20148, 10148), 9956, FEE_RATE, INPUT, BASE, CHANGE)
+        self.assertEqual([u['value'] for u in selected], [10148])
+        self.assertEqual((change, fee, how), (0, INPUT + BASE, 'branch_and_bound'))
+
+    def test_change(self):
+        selected, change, fee, how = cli.select_coins(coins(100000), 50000, FEE_RATE, INPUT, BASE, CHANGE)
+        self.assertEqual((change, fee, how), (49774, INPUT + BASE + CHANGE, 'single_coin'))
+
+    def test_dust_change_goes_to_fee(self):
+        selected, change, fee, how = cli.select_coins(coins(100000), 99408, FEE_RATE, INPUT, BASE, CHANGE)
+        self.assertEqual((change, fee, how), (0, 592, 'single_coin'))
+
+    def test_largest_first_fallback(self):
+        selected, change, fee, how = cli.select_coins(coins(30000, 30000, 30000, 100), 70000, FEE_RATE, INPUT, BASE, CHANGE)
+        self.assertEqual(len(selected), 3)
+        self.assertEqual((change, fee, how), (19478, 3 * INPUT + BASE + CHANGE, 'largest_first'))
+
+    def test_insufficient_funds(self):
+        self.assertRaises(click.ClickException, cli.select_coins, coins(1000, 2000), 5000, FEE_RATE, INPUT, BASE, CHANGE)
+
+    def test_coins_worth_less_than_their_fee_are_skipped(self):
+        self.assertRaises(click.ClickException, cli.select_coins, coins(*[100] * 100), 1000, FEE_RATE, INPUT, BASE, CHANGE)
+
+if __name__ == '__main__':
+    unittest.main()